@@ -1,8 +1,8 @@
 import os
 
-from flask import Flask
+from flask import Blueprint, Flask
 
-from flaskr.db import init_db
+from flaskr.db import check_db
 
 def create_app(test_config=None):
     # create and configure the app
@@ -10,6 +10,81 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        POSTS_PER_PAGE=5,
+        # old ?page=N links are still served with OFFSET up to this page
+        POSTS_LEGACY_PAGES=5,
+        # number of tags shown on /tags
+        TAG_CLOUD_SIZE=50,
+        COMMENTS_PER_PAGE=20,
+        # connections kept open per worker process; 0 disables pooling
+        DB_POOL_SIZE=5,
+        # seconds a request waits for a free connection
+        DB_POOL_TIMEOUT=10.0,
+        DB_CACHED_STATEMENTS=256,
+        # applied to every connection when it is opened
+        DB_PRAGMAS={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -16000,
+            'mmap_size': 134217728,
+            'busy_timeout': 5000,
+            'foreign_keys': 'on',
+        },
+        # serve pool and cache counters as JSON at /stats/
+        STATS_ENDPOINT=False,
+        # apply pending migrations on startup instead of only warning
+        DB_AUTO_UPGRADE=True,
+        # number of newest posts in /rss
+        RSS_ITEMS=20,
+        # serve every post, streamed, at /rss/archive
+        RSS_ARCHIVE=False,
+        # logged-in users cached per process, for at most USER_CACHE_TTL seconds
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=60,
+        # endpoints that never read g.user skip loading it
+        USER_SKIP_ENDPOINTS=('static', 'assets.asset', 'blog.rss', 'blog.rss_archive'),
+        # where post images are stored; served from /static/images/
+        IMAGE_FOLDER=os.path.join(app.static_folder, 'images'),
+        # widths of the resized copies made for each upload
+        IMAGE_WIDTHS=(320, 640, 1280),
+        # background threads making image variants; 0 makes them in the request
+        IMAGE_WORKERS=2,
+        IMAGE_QUEUE_SIZE=16,
+        # time every statement, report it in a Server-Timing header and log
+        # statements slower than SQL_SLOW_MS milliseconds
+        SQL_TRACE=False,
+        SQL_SLOW_MS=100,
+        # fingerprinted, precompressed copies made by "flask build-assets"
+        ASSET_FOLDER=os.path.join(app.instance_path, 'assets'),
+        # werkzeug hash method for new passwords; older hashes are upgraded
+        # on the next successful login
+        PASSWORD_METHOD='pbkdf2:sha256:600000',
+        PASSWORD_SALT_LENGTH=16,
+        # threads that hash passwords, and how many hashes may wait for
+        # them before logins are answered with 503; 0 hashes in the request
+        PASSWORD_WORKERS=2,
+        PASSWORD_MAX_PENDING=8,
+        PASSWORD_TIMEOUT=30,
+        # token buckets per endpoint and client: (burst, seconds to refill
+        # it[, methods counted]); shared by every worker through their own
+        # SQLite file
+        RATE_LIMITS={
+            'auth.login': (10, 60, ('POST',)),
+            'auth.register': (5, 3600, ('POST',)),
+            'blog.like': (60, 60),
+            'blog.comment': (10, 60),
+            'blog.search': (30, 60),
+            'api.search': (30, 60),
+        },
+        RATE_LIMIT_DATABASE=os.path.join(app.instance_path, 'ratelimit.sqlite'),
+        # requests run at once under the ASGI entry point (flaskr.asgi), each
+        # on a thread that keeps its own database connection
+        DB_EXECUTOR_WORKERS=8,
+        # cache anonymous page views: 'memory', 'disk' or None; at most
+        # RESPONSE_CACHE_SIZE entries are kept per process, or on disk
+        RESPONSE_CACHE='memory',
+        RESPONSE_CACHE_SIZE=256,
+        RESPONSE_CACHE_DIR=os.path.join(app.instance_path, 'response_cache'),
     )
 
     if test_config is None:
@@ -30,11 +105,25 @@ def create_app(test_config=None):
     def hello():
         return 'Greetings on my demo blog!'
 
+    from . import aio, db, ratelimit, tracing
+    db.init_app(app)
+    tracing.init_app(app)
+    ratelimit.init_app(app)
+
     with app.app_context():
-        init_db()
+        check_db()
 
-    from . import db
-    db.init_app(app)
+    from . import post
+    post.init_app(app)
+
+    from . import images
+    images.init_app(app)
+
+    from . import bench
+    bench.init_app(app)
+
+    from . import assets
+    assets.init_app(app)
 
     from .routers import auth
     app.register_blueprint(auth.bp)
@@ -43,4 +132,24 @@ def create_app(test_config=None):
     app.register_blueprint(blog.bp)
     app.add_url_rule('/', endpoint='index')
 
+    from .routers import api
+    app.register_blueprint(api.bp)
+
+    # scripts live in flaskr/js and are served from /js/
+    app.register_blueprint(
+        Blueprint('js', __name__, static_folder='js', static_url_path='/js')
+    )
+
+    from .routers import stats
+    stats.register(app, 'db_pool', lambda: db.get_pool(app).stats())
+    stats.register(app, 'user_cache', lambda: auth.get_user_cache(app).stats())
+    stats.register(app, 'sql', lambda: tracing.get_sql_stats(app).stats())
+    stats.register(app, 'rate_limited', lambda: ratelimit.get_limiter(app).stats())
+    stats.register(app, 'db_executor', lambda: aio.executor_stats(app))
+
+    from . import response_cache
+    stats.register(app, 'response_cache', lambda: response_cache.cache_stats(app))
+    if app.config['STATS_ENDPOINT']:
+        app.register_blueprint(stats.bp)
+
     return app
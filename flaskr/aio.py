@@ -0,0 +1,267 @@
+import asyncio
+import contextvars
+import io
+import os
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from .db import get_pool, owned
+from .log import init_logger
+
+
+logger = init_logger()
+
+
+class DbExecutor:
+    """Runs blocking work on threads that each own a database connection.
+
+    A worker opens its connection once, with the pool's settings but
+    outside the pool, and ``get_db`` returns it for everything the worker
+    runs. Work keeps the context it was submitted from, so code running
+    inside a request sees the same ``g`` and session.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.pid = os.getpid()
+        self.workers = app.config['DB_EXECUTOR_WORKERS']
+        self.executor = ThreadPoolExecutor(
+            self.workers, thread_name_prefix='flaskr-db', initializer=self._open
+        )
+        self._connections = []
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._running = 0
+
+    def _open(self):
+        # traced connections read their settings from the app
+        with self.app.app_context():
+            owned.db = get_pool(self.app).connect()
+        with self._lock:
+            self._connections.append(owned.db)
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if owned.db.in_transaction:
+                owned.db.rollback()
+            with self._lock:
+                self._running -= 1
+                self._calls += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` run on a worker, off the event loop."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, context.run, self._call, fn, args, kwargs
+        )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'open': len(self._connections),
+                'running': self._running,
+                'calls': self._calls,
+            }
+
+
+def get_db_executor(app=None):
+    app = app or current_app._get_current_object()
+    executor = app.extensions.get('flaskr_db_executor')
+    if executor is None or executor.pid != os.getpid():
+        # threads do not survive a fork; the child starts its own
+        executor = app.extensions['flaskr_db_executor'] = DbExecutor(app)
+    return executor
+
+
+def close_db_executor(app):
+    executor = app.extensions.pop('flaskr_db_executor', None)
+    if executor is not None and executor.pid == os.getpid():
+        executor.shutdown()
+
+
+def executor_stats(app):
+    executor = app.extensions.get('flaskr_db_executor')
+    return executor.stats() if executor is not None else {}
+
+
+def build_environ(scope, body):
+    """Return the WSGI environ of an ASGI HTTP request whose body has been read."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in environ:
+            environ[key] += ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        else:
+            environ[key] = value
+    return environ
+
+
+class AsgiApp:
+    """Serves the app to an ASGI server such as uvicorn.
+
+    Request bodies are read and responses sent on the event loop, so slow
+    clients cost no thread. Between the two, a request runs whole, from
+    the before_request hooks to the last chunk of its response, on one
+    DbExecutor worker, which uses its own connection throughout. Up to
+    DB_EXECUTOR_WORKERS requests run at once; the others wait without
+    holding a thread. Streamed responses are produced at the worker's pace
+    and queued for the client rather than held back by it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                close_db_executor(self.app)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        limit = self.app.config['MAX_CONTENT_LENGTH']
+        chunks, size, more = [], 0, True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            size += len(chunks[-1])
+            more = message.get('more_body', False)
+            if limit is not None and size > limit:
+                await self._send_error(send, 413, b'Request Entity Too Large')
+                return
+
+        environ = build_environ(scope, b''.join(chunks))
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def emit(kind, value=None):
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+
+        job = asyncio.ensure_future(get_db_executor(self.app).run(self._run, environ, emit))
+        # queued after everything the job emitted, also when the job failed
+        # before the app ran, for instance if its worker could not start
+        job.add_done_callback(lambda job: queue.put_nowait(('end', None)))
+        started = False
+        while True:
+            kind, value = await queue.get()
+            if kind == 'start':
+                status, headers = value
+                await send({
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [
+                        (header.lower().encode('latin1'), content.encode('latin1'))
+                        for header, content in headers
+                    ],
+                })
+                started = True
+            elif kind == 'body':
+                await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+            else:
+                break
+
+        try:
+            await job
+        except Exception:
+            if started:
+                raise
+            logger.exception(f'Error serving {scope["method"]} {scope["path"]}')
+            await self._send_error(send, 500, b'Internal Server Error')
+            return
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    def _run(self, environ, emit):
+        """Call the WSGI app on a worker, passing what it returns to ``emit``."""
+        response = []
+        sent = []
+
+        def send_headers():
+            if not sent:
+                emit('start', response[0])
+                sent.append(True)
+
+        def write(data):
+            if data:
+                send_headers()
+                emit('body', bytes(data))
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and sent:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [(status, headers)]
+            return write
+
+        result = self.app(environ, start_response)
+        try:
+            for data in result:
+                write(data)
+            send_headers()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    async def _send_error(send, status, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,9 @@
+"""ASGI entry point, for example ``uvicorn flaskr.asgi:app``.
+
+See flaskr.aio.AsgiApp for how requests are run.
+"""
+from flaskr import create_app
+from flaskr.aio import AsgiApp
+
+
+app = AsgiApp(create_app())
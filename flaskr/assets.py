@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+
+import click
+from flask import Blueprint, current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+bp = Blueprint('assets', __name__, url_prefix='/assets')
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.xml', '.html'}
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def asset_sources(app):
+    """Return ``(endpoint, prefix, folder)`` for every folder of built assets."""
+    return [
+        ('static', 'static', app.static_folder),
+        ('js.static', 'js', os.path.join(app.root_path, 'js')),
+    ]
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_assets(app):
+    """Copy assets to ASSET_FOLDER under content-hashed names.
+
+    Text assets also get ``.gz`` and, with the brotli module installed,
+    ``.br`` copies. Uploads directly in IMAGE_FOLDER are skipped: their
+    names are already derived from their content. Returns the manifest
+    mapping ``endpoint/filename`` to the fingerprinted path.
+    """
+    folder = app.config['ASSET_FOLDER']
+    uploads = os.path.abspath(app.config['IMAGE_FOLDER'])
+    manifest = {}
+    for endpoint, prefix, source in asset_sources(app):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            if os.path.abspath(root) == uploads:
+                continue
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                filename = os.path.relpath(path, source).replace(os.sep, '/')
+                stem, ext = os.path.splitext(filename)
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                built = f'{prefix}/{stem}.{digest}{ext}'
+                target = os.path.join(folder, built)
+
+                if not os.path.exists(target):
+                    _write(target, data)
+                    if ext.lower() in COMPRESSIBLE:
+                        variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+                        if brotli is not None:
+                            variants.append(('.br', brotli.compress(data)))
+                        for suffix, compressed in variants:
+                            if len(compressed) < len(data):
+                                _write(target + suffix, compressed)
+
+                manifest[f'{endpoint}/{filename}'] = built
+
+    _write(os.path.join(folder, 'manifest.json'), json.dumps(manifest, indent=2).encode('utf8'))
+    app.extensions['flaskr_assets'] = manifest
+    return manifest
+
+
+def get_manifest(app=None):
+    app = app or current_app
+    manifest = app.extensions.get('flaskr_assets')
+    if manifest is None:
+        try:
+            with open(os.path.join(app.config['ASSET_FOLDER'], 'manifest.json'), encoding='utf8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        app.extensions['flaskr_assets'] = manifest
+    return manifest
+
+
+def asset_url(endpoint, **values):
+    """``url_for`` that points at the fingerprinted copy of a built asset.
+
+    Falls back to ``url_for`` itself for files that were not built.
+    """
+    built = get_manifest().get(f'{endpoint}/{values.get("filename")}')
+    if built is None:
+        return url_for(endpoint, **values)
+    values['filename'] = built
+    return url_for('assets.asset', **values)
+
+
+@bp.route('/<path:filename>')
+def asset(filename):
+    folder = current_app.config['ASSET_FOLDER']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding, suffix = None, ''
+    for name, candidate in (('br', '.br'), ('gzip', '.gz')):
+        path = safe_join(folder, filename + candidate)
+        if request.accept_encodings[name] and path is not None and os.path.isfile(path):
+            encoding, suffix = name, candidate
+            break
+
+    response = send_from_directory(folder, filename + suffix, mimetype=mimetype, max_age=ONE_YEAR)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint and precompress the static files."""
+    manifest = build_assets(current_app)
+    click.echo(f'Built {len(manifest)} assets into {current_app.config["ASSET_FOLDER"]}.')
+
+
+def init_app(app):
+    app.register_blueprint(bp)
+    app.add_template_global(asset_url)
+    app.cli.add_command(build_assets_command)
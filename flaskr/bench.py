@@ -0,0 +1,587 @@
+import http.client
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from .images import URL_PREFIX, save_upload
+from .log import init_logger
+from .passwords import get_hasher
+from .post import Post
+from flaskr.db import close_pool, get_db, get_pool, init_db
+
+
+WORDS = (
+    "about after again against almost already always another answer around "
+    "because before behind between build cache change client code column "
+    "commit config cursor data database deploy design detail error example "
+    "feature field file flask follow format function handle header index "
+    "insert issue layout limit listing memory merge method model module "
+    "number object option order output page parser patch python query queue "
+    "read release render request result return route schema search server "
+    "session simple socket source static stream string table template test "
+    "thread token update upload value version view window worker write"
+).split()
+
+BENCH_PASSWORD = "bench"
+
+
+def _sentence(rng, low=6, high=16):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return " ".join(words).capitalize() + "."
+
+
+def _markdown(rng):
+    """Return a post body with the Markdown constructs seen in real posts."""
+    blocks = [f"## {_sentence(rng, 2, 5)[:-1]}"]
+    for _ in range(rng.randint(2, 6)):
+        words = " ".join(_sentence(rng) for _ in range(rng.randint(2, 5))).split()
+        i = rng.randrange(len(words))
+        words[i] = f"**{words[i]}**"
+        blocks.append(" ".join(words))
+    if rng.random() < 0.5:
+        blocks.append("\n".join(f"- {_sentence(rng, 3, 8)}" for _ in range(rng.randint(2, 5))))
+    if rng.random() < 0.3:
+        blocks.append(f"```python\n{rng.choice(WORDS)} = {rng.randint(0, 999)}\n```")
+    if rng.random() < 0.2:
+        blocks.append("| key | value |\n| --- | --- |\n" + "\n".join(
+            f"| {rng.choice(WORDS)} | {rng.randint(0, 99)} |" for _ in range(3)
+        ))
+    return "\n\n".join(blocks)
+
+
+def _weights(n):
+    # a few authors and tags account for most of the content
+    return [1 / (rank + 1) for rank in range(n)]
+
+
+def _seed_images(count):
+    """Store ``count`` small distinct PNG uploads and return their names."""
+    names = []
+    for i in range(count):
+        image = Image.new("RGB", (1600, 900), (40 * i % 256, 90, 160))
+        data = io.BytesIO()
+        image.save(data, "PNG")
+        data.seek(0)
+        names.append(save_upload(FileStorage(data, filename=f"seed-{i}.png")))
+    return names
+
+
+def seed(db, users=10, posts=100, tags=50, comments=3, likes=5, images=0.1, rng=None):
+    """Bulk-insert synthetic users, posts, tags, likes, comments and images.
+
+    ``comments`` and ``likes`` are averages per post and ``images`` is the
+    share of posts with an image. Returns the number of rows added per table.
+    """
+    rng = rng or random.Random(0)
+    first_user = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM user").fetchone()[0]
+    first_post = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM post").fetchone()[0]
+    # hashing is deliberately slow; every seeded user shares one password
+    password = get_hasher().hash(BENCH_PASSWORD)
+    tag_names = [
+        WORDS[i % len(WORDS)] + (str(i // len(WORDS)) if i >= len(WORDS) else "")
+        for i in range(tags)
+    ]
+    image_names = _seed_images(min(8, posts)) if images > 0 and posts else []
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / max(posts, 1)
+
+    with db:
+        db.executemany(
+            "INSERT INTO user (id, username, password) VALUES (?, ?, ?)",
+            [(id, f"user{id}", password) for id in range(first_user, first_user + users)],
+        )
+        user_ids = [
+            row[0] for row in db.execute("SELECT id FROM user ORDER BY id").fetchall()
+        ]
+        author_weights = _weights(len(user_ids))
+
+        post_rows, post_tags = [], []
+        for i in range(posts):
+            id = first_post + i
+            author = rng.choices(user_ids, author_weights)[0]
+            created = (start + step * i).strftime("%Y-%m-%d %H:%M:%S")
+            post_rows.append((id, _sentence(rng, 3, 7)[:-1], _markdown(rng), author, created))
+            if tag_names:
+                chosen = rng.choices(tag_names, _weights(len(tag_names)), k=rng.randint(0, 4))
+                post_tags.extend((id, name) for name in dict.fromkeys(chosen))
+        db.executemany(
+            "INSERT INTO post (id, title, body, author_id, created) VALUES (?, ?, ?, ?, ?)",
+            post_rows,
+        )
+        for id, _, body, _, _ in post_rows:
+            Post.store_html(db, id, body)
+
+        db.executemany(
+            "INSERT INTO tags (name_tag) VALUES (?) ON CONFLICT (name_tag) DO NOTHING",
+            [(name,) for name in tag_names],
+        )
+        db.executemany(
+            "INSERT INTO post_tag (post_id, tags_id) SELECT ?, id FROM tags WHERE name_tag = ?",
+            post_tags,
+        )
+
+        like_rows = {
+            (rng.choice(user_ids), first_post + rng.randrange(posts))
+            for _ in range(likes * posts)
+        } if posts else set()
+        db.executemany(
+            "INSERT OR IGNORE INTO post_like (user_id, post_id, liked) VALUES (?, ?, TRUE)",
+            sorted(like_rows),
+        )
+
+        comment_rows = []
+        for i in range(comments * posts):
+            post = rng.randrange(posts)
+            created = start + step * post + timedelta(minutes=rng.randint(1, 60 * 24 * 7))
+            comment_rows.append((
+                _sentence(rng, 4, 30), rng.choice(user_ids), first_post + post,
+                created.strftime("%Y-%m-%d %H:%M:%S"),
+            ))
+        db.executemany(
+            "INSERT INTO comment (body, author_id, post_id, created) VALUES (?, ?, ?, ?)",
+            comment_rows,
+        )
+
+        image_rows = [
+            (id, URL_PREFIX + rng.choice(image_names))
+            for id, *_ in post_rows if image_names and rng.random() < images
+        ]
+        db.executemany("INSERT INTO image (post_id, image_path) VALUES (?, ?)", image_rows)
+
+        db.execute(
+            "INSERT INTO post_search (rowid, title, body, tags) "
+            "SELECT p.id, p.title, p.body, "
+            "(SELECT group_concat(t.name_tag, ' ') FROM post_tag pt "
+            "JOIN tags t ON pt.tags_id = t.id WHERE pt.post_id = p.id) "
+            "FROM post p WHERE p.id >= ?",
+            (first_post,),
+        )
+
+    return {
+        "users": users,
+        "posts": posts,
+        "tags": len(tag_names),
+        "post_tags": len(post_tags),
+        "likes": len(like_rows),
+        "comments": len(comment_rows),
+        "images": len(image_rows),
+    }
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    values = sorted(values)
+    return values[max(math.ceil(q / 100 * len(values)), 1) - 1]
+
+
+def scenarios(db, size):
+    """Return ``(name, method, url, data, needs_login)`` for every timed request."""
+    rng = random.Random(size)
+    post_ids = [row[0] for row in db.execute("SELECT id FROM post").fetchall()]
+    post_id = rng.choice(post_ids)
+    tag = db.execute(
+        "SELECT t.name_tag FROM tag_stats s JOIN tags t ON t.id = s.tags_id "
+        "ORDER BY s.post_count DESC LIMIT 1"
+    ).fetchone()
+    return [
+        ("index", "GET", "/", None, False),
+        ("post", "GET", f"/{post_id}", None, False),
+        ("tag", "GET", f"/tag/{tag[0] if tag else 'none'}", None, False),
+        ("search", "GET", f"/search?q={rng.choice(WORDS)}", None, False),
+        ("rss", "GET", "/rss", None, False),
+        ("like", "POST", f"/{post_id}/like", None, True),
+        ("comment", "POST", f"/{post_id}/comment", {"body": "benchmark comment"}, True),
+    ]
+
+
+def seeded_app(folder, name, size, **config):
+    """Create an app on a new database in ``folder`` seeded with ``size`` posts."""
+    from . import create_app
+
+    app = create_app({
+        "TESTING": True,
+        "DATABASE": os.path.join(folder, f"{name}.sqlite"),
+        "IMAGE_FOLDER": os.path.join(folder, "images"),
+        "IMAGE_WORKERS": 0,
+        "RESPONSE_CACHE": None,
+        "RATE_LIMITS": {},
+        **config,
+    })
+    os.makedirs(app.config["IMAGE_FOLDER"], exist_ok=True)
+
+    with app.app_context():
+        init_db()
+        seed(get_db(), users=max(size // 20, 2), posts=size, tags=max(size // 10, 5))
+    return app
+
+
+def run_size(size, iterations, statements, folder):
+    """Seed a fresh database of ``size`` posts and time every scenario on it."""
+    app = seeded_app(folder, f"bench-{size}", size)
+
+    with app.app_context():
+        cases = scenarios(get_db(), size)
+        username = get_db().execute("SELECT username FROM user LIMIT 1").fetchone()[0]
+
+    # count the statements of every connection, including those run before
+    # the view, such as loading the logged in user; statements SQLite runs
+    # internally (FTS5 shadow tables, triggers) start with "--"
+    pool = get_pool(app)
+    pool.dispose()
+    connect = pool.connect
+
+    def traced_connect():
+        db = connect()
+        db.set_trace_callback(
+            lambda sql: None if sql.startswith("--") else statements.append(sql)
+        )
+        return db
+
+    pool.connect = traced_connect
+
+    anonymous, member = app.test_client(), app.test_client()
+    member.post("/auth/login", data={"username": username, "password": BENCH_PASSWORD})
+
+    results = []
+    for name, method, url, data, needs_login in cases:
+        client = member if needs_login else anonymous
+        headers = {"Accept": "application/json"} if name == "like" else {}
+
+        def call():
+            response = client.open(url, method=method, data=data, headers=headers)
+            response.get_data()
+            if response.status_code >= 400:
+                raise click.ClickException(f"{method} {url} returned {response.status_code}")
+
+        call()
+        timings, queries = [], []
+        for _ in range(iterations):
+            statements.clear()
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+            queries.append(len(statements))
+
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append({
+            "size": size,
+            "scenario": name,
+            "p50_ms": round(percentile(timings, 50) * 1000, 3),
+            "p95_ms": round(percentile(timings, 95) * 1000, 3),
+            "queries": max(queries),
+            "peak_kb": round(peak / 1024, 1),
+        })
+
+    close_pool(app)
+    return results
+
+
+def run_login_load(app, duration, login_threads, read_threads):
+    """Log in and read the index from several threads at once for ``duration``.
+
+    Returns throughput and latency of both, showing how much password
+    hashing slows down page reads running next to it.
+    """
+    with app.app_context():
+        username = get_db().execute("SELECT username FROM user LIMIT 1").fetchone()[0]
+
+    timings = {"login": [], "read": []}
+    rejected = []
+    deadline = time.perf_counter() + duration
+
+    def login():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = client.post(
+                "/auth/login", data={"username": username, "password": BENCH_PASSWORD}
+            )
+            if response.status_code == 503:
+                rejected.append(1)
+            else:
+                timings["login"].append(time.perf_counter() - start)
+
+    def read():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            client.get("/").get_data()
+            timings["read"].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=login) for _ in range(login_threads)]
+    threads += [threading.Thread(target=read) for _ in range(read_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = {"rejected_logins": len(rejected)}
+    for name, values in timings.items():
+        result[f"{name}s_per_s"] = round(len(values) / duration, 1)
+        result[f"{name}_p50_ms"] = round(percentile(values, 50) * 1000, 3) if values else None
+        result[f"{name}_p95_ms"] = round(percentile(values, 95) * 1000, 3) if values else None
+    return result
+
+
+def run_http_load(url, paths, duration, connections, slow_clients=0):
+    """Request ``paths`` from the server at ``url`` over ``connections`` connections.
+
+    Each of ``slow_clients`` more connections sends its request headers a
+    line at a time for the whole run, as a slow client would, so servers
+    that tie a thread to every open request show it in the results.
+    """
+    parts = urllib.parse.urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    prefix = parts.path.rstrip("/")
+    timings, errors = [], []
+    deadline = time.perf_counter() + duration
+
+    def read(offset):
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", prefix + paths[i % len(paths)])
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    errors.append(response.status)
+                if response.will_close:
+                    connection.close()
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                connection.close()
+            timings.append(time.perf_counter() - start)
+            i += 1
+        connection.close()
+
+    def dribble():
+        try:
+            with socket.create_connection((host, port), timeout=duration + 30) as sock:
+                sock.sendall(f"GET {prefix or '/'} HTTP/1.1\r\nHost: {host}\r\n".encode())
+                line = 0
+                while time.perf_counter() < deadline:
+                    time.sleep(min(0.5, max(deadline - time.perf_counter(), 0)))
+                    sock.sendall(f"X-Slow-{line}: 1\r\n".encode())
+                    line += 1
+                sock.sendall(b"Connection: close\r\n\r\n")
+                while sock.recv(65536):
+                    pass
+        except OSError:
+            pass
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(connections)]
+    threads += [threading.Thread(target=dribble) for _ in range(slow_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        "errors": len(errors),
+        "reads_per_s": round(len(timings) / duration, 1),
+        "read_p50_ms": round(percentile(timings, 50) * 1000, 3) if timings else None,
+        "read_p95_ms": round(percentile(timings, 95) * 1000, 3) if timings else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command('seed')
+@click.option('--users', default=50, show_default=True)
+@click.option('--posts', default=1000, show_default=True)
+@click.option('--tags', default=100, show_default=True)
+@click.option('--comments', default=3, show_default=True, help='Average comments per post.')
+@click.option('--likes', default=5, show_default=True, help='Average likes per post.')
+@click.option('--images', default=0.1, show_default=True, help='Share of posts with an image.')
+@click.option('--seed', 'random_seed', default=0, show_default=True)
+@with_appcontext
+def seed_command(users, posts, tags, comments, likes, images, random_seed):
+    """Fill the database with synthetic users, posts and activity."""
+    start = time.perf_counter()
+    counts = seed(
+        get_db(), users=users, posts=posts, tags=tags, comments=comments,
+        likes=likes, images=images, rng=random.Random(random_seed),
+    )
+    summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+    click.echo(f'Added {summary} in {time.perf_counter() - start:.1f}s.')
+
+
+@click.command('bench')
+@click.option('--sizes', default='100,1000', show_default=True,
+              help='Comma separated post counts to benchmark at.')
+@click.option('--iterations', default=30, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON.')
+@click.option('--compare', type=click.File(), help='A previous --output file to compare with.')
+def bench_command(sizes, iterations, output, compare):
+    """Time the main pages against freshly seeded databases."""
+    statements = []
+    folder = tempfile.mkdtemp(prefix="flaskr-bench-")
+    # per-request debug logging would dominate the timings
+    logger = init_logger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        results = []
+        for size in (int(size) for size in sizes.split(",")):
+            results.extend(run_size(size, iterations, statements, folder))
+    finally:
+        logger.setLevel(level)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    baseline = {}
+    if compare is not None:
+        baseline = {(r["size"], r["scenario"]): r for r in json.load(compare)["results"]}
+
+    click.echo(f'{"size":>6} {"scenario":<10} {"p50 ms":>9} {"p95 ms":>9} '
+               f'{"queries":>7} {"peak KiB":>9}')
+    for r in results:
+        line = (f'{r["size"]:>6} {r["scenario"]:<10} {r["p50_ms"]:>9.2f} {r["p95_ms"]:>9.2f} '
+                f'{r["queries"]:>7} {r["peak_kb"]:>9.1f}')
+        old = baseline.get((r["size"], r["scenario"]))
+        if old is not None and old["p50_ms"]:
+            line += f' {(r["p50_ms"] / old["p50_ms"] - 1) * 100:+6.1f}%'
+        click.echo(line)
+
+    if output:
+        with open(output, 'w', encoding='utf8') as f:
+            json.dump({
+                "commit": _git_commit(),
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "iterations": iterations,
+                "results": results,
+            }, f, indent=2)
+        click.echo(f'Results written to {output}.')
+
+
+@click.command('bench-login')
+@click.option('--duration', default=5.0, show_default=True, help='Seconds per run.')
+@click.option('--login-threads', default=4, show_default=True)
+@click.option('--read-threads', default=4, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON.')
+@with_appcontext
+def bench_login_command(duration, login_threads, read_threads, output):
+    """Compare login and page read throughput with and without the hashing cap."""
+    config = {
+        name: current_app.config[name]
+        for name in ('PASSWORD_METHOD', 'PASSWORD_SALT_LENGTH', 'PASSWORD_WORKERS',
+                     'PASSWORD_MAX_PENDING')
+    }
+    runs = [
+        ('inline', dict(config, PASSWORD_WORKERS=0)),
+        ('capped', config),
+    ]
+    folder = tempfile.mkdtemp(prefix="flaskr-bench-")
+    logger = init_logger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        results = []
+        for name, run_config in runs:
+            app = seeded_app(folder, f"login-{name}", 100, **run_config)
+            result = run_login_load(app, duration, login_threads, read_threads)
+            results.append({"mode": name, **result})
+            close_pool(app)
+    finally:
+        logger.setLevel(level)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    for result in results:
+        click.echo(
+            f'{result["mode"]:<7} logins/s {result["logins_per_s"]:>7} '
+            f'(p95 {result["login_p95_ms"]} ms, {result["rejected_logins"]} rejected)  '
+            f'reads/s {result["reads_per_s"]:>7} (p95 {result["read_p95_ms"]} ms)'
+        )
+
+    if output:
+        with open(output, 'w', encoding='utf8') as f:
+            json.dump({
+                "commit": _git_commit(),
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "duration": duration,
+                "login_threads": login_threads,
+                "read_threads": read_threads,
+                "config": config,
+                "results": results,
+            }, f, indent=2)
+        click.echo(f'Results written to {output}.')
+
+
+@click.command('bench-server')
+@click.option('--url', 'urls', multiple=True, required=True,
+              help='NAME=URL of a running server; repeat it to compare servers.')
+@click.option('--path', 'paths', multiple=True, show_default=True,
+              default=('/', '/tags', '/api/v1/posts', '/rss'), help='Paths to request in turn.')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds per server.')
+@click.option('--connections', default=16, show_default=True)
+@click.option('--slow-clients', default=0, show_default=True,
+              help='Extra connections that send their request slowly.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the results as JSON.')
+def bench_server_command(urls, paths, duration, connections, slow_clients, output):
+    """Load test running servers, such as the WSGI and the ASGI app."""
+    results = []
+    for item in urls:
+        name, _, url = item.rpartition("=")
+        result = run_http_load(url, paths, duration, connections, slow_clients)
+        results.append({"server": name or url, "url": url, **result})
+        click.echo(
+            f'{name or url:<10} reads/s {result["reads_per_s"]:>8} '
+            f'(p50 {result["read_p50_ms"]} ms, p95 {result["read_p95_ms"]} ms, '
+            f'{result["errors"]} errors)'
+        )
+
+    if output:
+        with open(output, 'w', encoding='utf8') as f:
+            json.dump({
+                "commit": _git_commit(),
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "duration": duration,
+                "connections": connections,
+                "slow_clients": slow_clients,
+                "paths": list(paths),
+                "results": results,
+            }, f, indent=2)
+        click.echo(f'Results written to {output}.')
+
+
+def init_app(app):
+    app.cli.add_command(seed_command)
+    app.cli.add_command(bench_command)
+    app.cli.add_command(bench_login_command)
+    app.cli.add_command(bench_server_command)
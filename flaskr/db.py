@@ -1,16 +1,185 @@
 import click
+import math
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
 
-from flask import current_app, g
+from flask import current_app, g, has_request_context
+from flask.cli import with_appcontext
+from werkzeug.exceptions import ServiceUnavailable
+
+from .tracing import TracedConnection
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became free within the wait time."""
+
+
+class ConnectionPool:
+    """A bounded pool of SQLite connections owned by a single process.
+
+    A connection is handed to one thread at a time: it is checked out by
+    ``get_db`` for the duration of an app context and returned to the pool
+    by ``close_db``. Connections are created lazily, tuned with the
+    configured PRAGMAs once when they are opened, and are never shared with
+    a forked child process.
+    """
+
+    def __init__(self, database, size=5, timeout=10.0, pragmas=None, cached_statements=256,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self.cached_statements = cached_statements
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # LIFO, so the most recently used connection (and its warm page
+        # cache) is handed out first
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def connect(self):
+        db = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.factory,
+        )
+        db.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            if not re.fullmatch(r"\w+", name) or not re.fullmatch(r"[\w-]+", str(value)):
+                raise ValueError(f"Invalid PRAGMA {name}={value!r}")
+            db.execute(f"PRAGMA {name} = {value}").fetchall()
+        return db
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            # connections opened before a fork belong to the parent
+            with self._lock:
+                self._reset()
+
+        start = time.perf_counter()
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    db = self.connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    db = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection free after {self.timeout}s."
+                    )
+                waited = time.perf_counter() - start
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time += waited
+                    self._max_wait = max(self._max_wait, waited)
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return db
+
+    def release(self, db):
+        if self._pid != os.getpid():
+            return
+        if db.in_transaction:
+            db.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(db)
+
+    def dispose(self):
+        """Close every idle connection and forget about the busy ones."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time': round(self._wait_time, 6),
+                'max_wait': round(self._max_wait, 6),
+            }
+
+
+def get_pool(app=None):
+    app = app or current_app
+    pool = app.extensions.get('flaskr_db_pool')
+    if pool is None:
+        pool = app.extensions['flaskr_db_pool'] = ConnectionPool(
+            app.config['DATABASE'],
+            size=app.config['DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            pragmas=app.config['DB_PRAGMAS'],
+            cached_statements=app.config['DB_CACHED_STATEMENTS'],
+            factory=TracedConnection if app.config['SQL_TRACE'] else sqlite3.Connection,
+        )
+    return pool
+
+
+# connections owned by a thread instead of an app context: the workers of
+# the executor in flaskr.aio each keep one here, and get_db prefers it
+owned = threading.local()
 
 
 def get_db():
+    db = getattr(owned, 'db', None)
+    if db is not None:
+        return db
+
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        pool = get_pool()
+        if pool.size > 0:
+            try:
+                g.db = pool.acquire()
+            except PoolTimeout as e:
+                if not has_request_context():
+                    raise
+                # every connection is busy; ask the client to come back
+                # rather than failing as an internal error
+                raise ServiceUnavailable(str(e), retry_after=math.ceil(pool.timeout)) from e
+        else:
+            g.db = pool.connect()
 
     return g.db
 
@@ -19,23 +188,156 @@ def close_db(e=None):
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        pool = get_pool()
+        if pool.size > 0:
+            pool.release(db)
+        else:
+            db.close()
 
 
-def init_db():
+def close_pool(app):
+    pool = app.extensions.pop('flaskr_db_pool', None)
+    if pool is not None:
+        pool.dispose()
+
+
+def get_generation(name):
+    """Return ``(value, updated)`` of a write counter from the generation table."""
+    row = get_db().execute(
+        'SELECT value, updated FROM generation WHERE name = ?', (name,)
+    ).fetchone()
+    return (row['value'], row['updated']) if row is not None else (0, None)
+
+
+def get_generations(names):
+    """Return the current values of several write counters as a tuple."""
+    placeholders = ', '.join('?' * len(names))
+    values = dict(get_db().execute(
+        f'SELECT name, value FROM generation WHERE name IN ({placeholders})',
+        tuple(names),
+    ).fetchall())
+    return tuple(values.get(name, 0) for name in names)
+
+
+def bump_generation(*names, commit=True):
+    """Increment write counters, creating them as needed.
+
+    Pass ``commit=False`` to make the bump part of the caller's transaction.
+    """
     db = get_db()
+    db.executemany(
+        'INSERT INTO generation (name, value) VALUES (?, 1) '
+        'ON CONFLICT (name) DO UPDATE SET value = value + 1, updated = CURRENT_TIMESTAMP',
+        [(name,) for name in names],
+    )
+    if commit:
+        db.commit()
+
+
+def iter_rows(cursor, size=100):
+    """Yield the rows of a cursor, fetching them ``size`` at a time."""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
 
-    with current_app.open_resource('schema.sql') as f:
-        db.executescript(f.read().decode('utf8'))
+def get_migrations():
+    """Return ``(version, name, sql)`` for every file in ``migrations/``.
+
+    Files are named ``NNNN_description.sql`` and applied in version order.
+    """
+    directory = os.path.join(current_app.root_path, 'migrations')
+    migrations = []
+    for filename in os.listdir(directory):
+        match = re.fullmatch(r'(\d+)_\w+\.sql', filename)
+        if match is None:
+            continue
+        with open(os.path.join(directory, filename), encoding='utf8') as f:
+            migrations.append((int(match.group(1)), filename, f.read()))
+
+    return sorted(migrations)
+
+
+def split_statements(sql):
+    statement = ''
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def upgrade_db():
+    """Apply pending migrations and return the names of those applied."""
+    db = get_db()
+    migrations = get_migrations()
+    if not migrations or schema_version(db) >= migrations[-1][0]:
+        return []
+
+    # the write lock serializes workers that boot at the same time; the
+    # version is read again once it is held
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        current = schema_version(db)
+        applied = []
+        for version, name, sql in migrations:
+            if version <= current:
+                continue
+            for statement in split_statements(sql):
+                db.execute(statement)
+            db.execute(f'PRAGMA user_version = {version:d}')
+            applied.append(name)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return applied
+
+
+def check_db():
+    """Cheap startup check: upgrade only when the schema is behind."""
+    db = get_db()
+    current, latest = schema_version(db), get_migrations()[-1][0]
+    if current >= latest:
+        return
+    if current_app.config['DB_AUTO_UPGRADE']:
+        upgrade_db()
+    else:
+        current_app.logger.warning(
+            f'Database schema is at version {current}, {latest} is available. '
+            'Run "flask db-upgrade".'
+        )
+
+
+def init_db():
+    upgrade_db()
 
 
 @click.command('init-db')
 def init_db_command():
-    """Clear the existing data and create new tables."""
+    """Create the tables of a new database."""
     init_db()
     click.echo('Initialized the database.')
 
 
+@click.command('db-upgrade')
+@with_appcontext
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    applied = upgrade_db()
+    for name in applied:
+        click.echo(f'Applied {name}')
+    click.echo(f'Database is at version {schema_version(get_db())}.')
+
+
 def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_upgrade_command)
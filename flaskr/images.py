@@ -0,0 +1,168 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image, ImageOps, UnidentifiedImageError
+from werkzeug.utils import secure_filename
+
+from .log import init_logger
+from flaskr.db import bump_generation, get_db
+
+
+logger = init_logger()
+
+URL_PREFIX = "/static/images/"
+
+
+def save_upload(file):
+    """Store an upload under a name derived from its content and return it.
+
+    Identical uploads share one file, and names can never collide.
+    """
+    data = file.read()
+    ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+    filename = hashlib.sha256(data).hexdigest()[:32] + ext
+    folder = current_app.config["IMAGE_FOLDER"]
+    path = os.path.join(folder, filename)
+
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(dir=folder)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    return filename
+
+
+def _save(image, path, ext):
+    image_format = Image.registered_extensions()[ext]
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        image.save(f, image_format, quality=82)
+    os.replace(tmp_path, path)
+
+
+def make_variants(db, image_id, filename, folder, widths):
+    """Write resized and WebP copies of an image and record them.
+
+    Returns the number of variants recorded, the original included.
+    """
+    base, ext = os.path.splitext(filename)
+    try:
+        with Image.open(os.path.join(folder, filename)) as original:
+            original.load()
+            image = ImageOps.exif_transpose(original)
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning(f'Cannot make variants of {filename}: {e}')
+        return 0
+
+    variants = [(image.width, ext.lstrip("."), filename)]
+    sizes = [width for width in sorted(widths) if width < image.width]
+    for width in sizes + [image.width]:
+        if width == image.width:
+            resized, suffix = image, ""
+        else:
+            height = max(1, round(image.height * width / image.width))
+            resized, suffix = image.resize((width, height), Image.LANCZOS), f"-{width}"
+        for variant_ext in dict.fromkeys((ext, ".webp")):
+            if variant_ext not in Image.registered_extensions():
+                continue
+            name = f"{base}{suffix}{variant_ext}"
+            if name == filename:
+                continue
+            path = os.path.join(folder, name)
+            if not os.path.exists(path):
+                _save(resized, path, variant_ext)
+            variants.append((width, variant_ext.lstrip("."), name))
+
+    db.execute("DELETE FROM image_variant WHERE image_id = ?", (image_id,))
+    db.executemany(
+        "INSERT INTO image_variant (image_id, width, format, path) VALUES (?, ?, ?, ?)",
+        [(image_id, width, fmt, URL_PREFIX + name) for width, fmt, name in variants],
+    )
+
+    return len(variants)
+
+
+class ImagePipeline:
+    """Makes image variants on a bounded pool of worker threads.
+
+    At most ``IMAGE_QUEUE_SIZE`` images wait for a worker; beyond that, and
+    when ``IMAGE_WORKERS`` is 0, the calling request does the work itself.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        workers = app.config["IMAGE_WORKERS"]
+        self.executor = (
+            ThreadPoolExecutor(workers, thread_name_prefix="flaskr-images")
+            if workers > 0 else None
+        )
+        self.slots = threading.BoundedSemaphore(max(app.config["IMAGE_QUEUE_SIZE"], 1))
+
+    def submit(self, image_id, filename):
+        if self.executor is None or not self.slots.acquire(blocking=False):
+            self.process(image_id, filename)
+            return None
+
+        future = self.executor.submit(self.process, image_id, filename)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            logger.error(f'Image processing failed: {future.exception()!r}')
+
+    def process(self, image_id, filename):
+        with self.app.app_context():
+            db = get_db()
+            row = db.execute("SELECT post_id FROM image WHERE id = ?", (image_id,)).fetchone()
+            made = make_variants(
+                db, image_id, filename,
+                self.app.config["IMAGE_FOLDER"], self.app.config["IMAGE_WIDTHS"],
+            )
+            if made and row is not None:
+                # pages cached before the variants existed lack their srcset
+                bump_generation("posts", f"post:{row[0]}", commit=False)
+            db.commit()
+
+
+def get_pipeline(app=None):
+    app = app or current_app._get_current_object()
+    pipeline = app.extensions.get("flaskr_images")
+    if pipeline is None:
+        pipeline = app.extensions["flaskr_images"] = ImagePipeline(app)
+    return pipeline
+
+
+@click.command('regenerate-images')
+@with_appcontext
+def regenerate_images_command():
+    """Make missing variants for every uploaded post image."""
+    db = get_db()
+    folder = current_app.config["IMAGE_FOLDER"]
+    images = db.execute("SELECT id, post_id, image_path FROM image ORDER BY id").fetchall()
+    done = 0
+    for image in images:
+        filename = os.path.basename(image["image_path"])
+        if not os.path.exists(os.path.join(folder, filename)):
+            click.echo(f'Missing file {filename}, skipped.')
+            continue
+        if make_variants(db, image["id"], filename, folder, current_app.config["IMAGE_WIDTHS"]):
+            bump_generation("posts", f"post:{image['post_id']}", commit=False)
+            done += 1
+        db.commit()
+    click.echo(f'Processed {done} of {len(images)} images.')
+
+
+def init_app(app):
+    app.cli.add_command(regenerate_images_command)
@@ -0,0 +1,21 @@
+// Load the next page of comments in place of the "More comments" link.
+// Without JavaScript the link opens the post page at that comment page.
+document.addEventListener('click', function (event) {
+    var link = event.target;
+    if (!link.classList || !link.classList.contains('comments-more')) {
+        return;
+    }
+    event.preventDefault();
+
+    fetch(link.dataset.fragment, {credentials: 'same-origin'}).then(function (response) {
+        if (!response.ok) {
+            throw new Error(response.status);
+        }
+        return response.text();
+    }).then(function (html) {
+        link.insertAdjacentHTML('beforebegin', html);
+        link.remove();
+    }).catch(function () {
+        window.location = link.href;
+    });
+});
@@ -1,9 +1,21 @@
-$(document).ready(function(){
-   $(".read-more").click(function(){
-       $(this).prev(".more").css({
-           "max-height": "none",
-           "overflow": "visible"
-       });
-   });
-});
+// Replace a listed post's excerpt with its full body when "Read more" is
+// clicked. Without JavaScript the link opens the post page.
+document.addEventListener('click', function (event) {
+    var link = event.target;
+    if (!link.classList || !link.classList.contains('read-more')) {
+        return;
+    }
+    event.preventDefault();
 
+    fetch(link.dataset.body, {credentials: 'same-origin'}).then(function (response) {
+        if (!response.ok) {
+            throw new Error(response.status);
+        }
+        return response.text();
+    }).then(function (html) {
+        link.previousElementSibling.innerHTML = html;
+        link.remove();
+    }).catch(function () {
+        window.location = link.href;
+    });
+});
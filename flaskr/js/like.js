@@ -0,0 +1,26 @@
+// Submit like forms with fetch and update the button in place. Falls back
+// to a normal form submission when the request does not return JSON.
+document.addEventListener('submit', function (event) {
+    var form = event.target;
+    if (!form.classList.contains('like')) {
+        return;
+    }
+    event.preventDefault();
+
+    fetch(form.action, {
+        method: 'POST',
+        headers: {'Accept': 'application/json'},
+        credentials: 'same-origin'
+    }).then(function (response) {
+        if (!response.ok || response.headers.get('Content-Type') !== 'application/json') {
+            throw new Error(response.status);
+        }
+        return response.json();
+    }).then(function (data) {
+        var button = form.querySelector('input[type="submit"]');
+        button.value = 'Like (' + data.likes + ')';
+        form.classList.toggle('liked', data.liked);
+    }).catch(function () {
+        form.submit();
+    });
+});
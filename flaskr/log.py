@@ -5,6 +5,10 @@ def init_logger():
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
 
+    # every module calls init_logger; only the first call adds a handler
+    if logger.handlers:
+        return logger
+
     handler = logging.StreamHandler()
     handler.setLevel(logging.DEBUG)
 
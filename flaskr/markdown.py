@@ -1,3 +1,124 @@
+import hashlib
+from html import escape
+from html.parser import HTMLParser
+from threading import Lock
+
+import markdown
 from markdown import Markdown
 
-md = Markdown(extensions=["fenced_code", "tables"])
+from .cache import LRUCache
+
+EXTENSIONS = ["fenced_code", "tables"]
+
+# listings show the first EXCERPT_BLOCKS top-level blocks of a post, or
+# as many as fit in EXCERPT_CHARS characters of HTML; a longer first
+# block is shown as plain text cut at EXCERPT_CHARS
+EXCERPT_BLOCKS = 3
+EXCERPT_CHARS = 600
+# bumped when excerpt() itself changes
+EXCERPT_FORMAT = 2
+
+md = Markdown(extensions=EXTENSIONS)
+
+# Changes whenever the Markdown version, the extension set or the excerpt
+# size changes, so stored HTML rendered by an older configuration is
+# treated as stale.
+RENDERER_VERSION = (
+    f"{markdown.__version__}:{','.join(sorted(EXTENSIONS))}:"
+    f"{EXCERPT_BLOCKS}:{EXCERPT_CHARS}:{EXCERPT_FORMAT}"
+)
+
+html_cache = LRUCache(maxsize=512)
+
+_md_lock = Lock()
+
+
+def content_hash(body):
+    return hashlib.sha1(f"{RENDERER_VERSION}\n{body}".encode("utf8")).hexdigest()
+
+
+def render(body):
+    # a Markdown instance keeps per-document state and is not thread safe
+    with _md_lock:
+        return md.reset().convert(body)
+
+
+_VOID_TAGS = {"area", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+
+
+class _BlockEnds(HTMLParser):
+    """Collects the offsets at which top-level HTML elements end."""
+
+    def __init__(self, html):
+        super().__init__(convert_charrefs=False)
+        self.html = html
+        # getpos() counts "\n" only, unlike str.splitlines()
+        self.line_starts = [0]
+        for line in html.split("\n"):
+            self.line_starts.append(self.line_starts[-1] + len(line) + 1)
+        self.depth = 0
+        self.ends = []
+
+    def _tag_end(self):
+        line, column = self.getpos()
+        return self.html.index(">", self.line_starts[line - 1] + column) + 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in _VOID_TAGS:
+            self.depth += 1
+        elif self.depth == 0:
+            self.ends.append(self._tag_end())
+
+    def handle_startendtag(self, tag, attrs):
+        if self.depth == 0:
+            self.ends.append(self._tag_end())
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        self.depth = max(self.depth - 1, 0)
+        if self.depth == 0:
+            self.ends.append(self._tag_end())
+
+
+class _Text(HTMLParser):
+    """Collects the text of an HTML fragment."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def _text_excerpt(html):
+    parser = _Text()
+    parser.feed(html)
+    parser.close()
+    text = " ".join("".join(parser.parts).split())
+    if len(text) > EXCERPT_CHARS:
+        text = text[:EXCERPT_CHARS].rsplit(" ", 1)[0] + "\u2026"
+    return f"<p>{escape(text, quote=False)}</p>"
+
+
+def excerpt(html):
+    """Return ``(excerpt, truncated)``: the leading blocks of rendered HTML."""
+    parser = _BlockEnds(html)
+    parser.feed(html)
+    parser.close()
+
+    cut = 0
+    for count, end in enumerate(parser.ends, 1):
+        if end > EXCERPT_CHARS:
+            break
+        cut = end
+        if count == EXCERPT_BLOCKS:
+            break
+    else:
+        if len(html) <= EXCERPT_CHARS:
+            cut = len(html)
+
+    if cut == 0:
+        return _text_excerpt(html[:parser.ends[0]] if parser.ends else html), True
+    return html[:cut], bool(html[cut:].strip())
@@ -0,0 +1,163 @@
+-- Initial schema. Statements use IF NOT EXISTS so that databases created
+-- before migrations existed (user_version 0) are upgraded in place.
+
+-- DROP TABLE IF EXISTS user;
+-- DROP TABLE IF EXISTS post;
+-- DROP TABLE IF EXISTS post_like;
+-- DROP TABLE IF EXISTS comment;
+-- DROP TABLE IF EXISTS post_tag;
+-- DROP TABLE IF EXISTS tags;
+-- DROP TABLE IF EXISTS image;
+-- DROP TABLE IF EXISTS post_html;
+-- DROP TABLE IF EXISTS post_stats;
+-- DROP TABLE IF EXISTS post_search;
+
+CREATE TABLE IF NOT EXISTS user (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL,
+  avatar_path TEXT
+);
+
+CREATE TABLE IF NOT EXISTS post (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id)
+);
+
+CREATE INDEX IF NOT EXISTS post_created_id_idx ON post (created, id);
+
+CREATE TABLE IF NOT EXISTS post_like (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER NOT NULL,
+  post_id INTEGER NOT NULL,
+  liked BOOLEAN NOT NULL DEFAULT FALSE,
+  FOREIGN KEY (user_id) REFERENCES user (id),
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
+
+CREATE TABLE IF NOT EXISTS comment (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  author_id INTEGER NOT NULL,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  post_id INTEGER NOT NULL,
+  body TEXT NOT NULL,
+  FOREIGN KEY (author_id) REFERENCES user (id),
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
+
+CREATE TABLE IF NOT EXISTS post_tag (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL,
+  tags_id INTEGER NOT NULL,
+  FOREIGN KEY (post_id) REFERENCES post (id),
+  FOREIGN KEY (tags_id) REFERENCES tags (id)
+);
+
+CREATE TABLE IF NOT EXISTS tags (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name_tag TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS image (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL,
+  image_path TEXT NOT NULL,
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
+
+CREATE TABLE IF NOT EXISTS post_html (
+  post_id INTEGER PRIMARY KEY,
+  body_hash TEXT NOT NULL,
+  html TEXT NOT NULL,
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
+
+-- Denormalized counters, maintained by the triggers below and
+-- recomputed by `flask reconcile-counters`.
+CREATE TABLE IF NOT EXISTS post_stats (
+  post_id INTEGER PRIMARY KEY,
+  likes INTEGER NOT NULL DEFAULT 0,
+  comments INTEGER NOT NULL DEFAULT 0,
+  images INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
+
+INSERT OR IGNORE INTO post_stats (post_id, likes, comments, images)
+SELECT p.id,
+  (SELECT COUNT(*) FROM post_like WHERE post_id = p.id AND liked = TRUE),
+  (SELECT COUNT(*) FROM comment WHERE post_id = p.id),
+  (SELECT COUNT(*) FROM image WHERE post_id = p.id)
+FROM post p;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_post_insert AFTER INSERT ON post
+BEGIN
+  INSERT OR IGNORE INTO post_stats (post_id) VALUES (NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_post_delete AFTER DELETE ON post
+BEGIN
+  DELETE FROM post_stats WHERE post_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_like_insert AFTER INSERT ON post_like
+WHEN NEW.liked
+BEGIN
+  INSERT INTO post_stats (post_id, likes) VALUES (NEW.post_id, 1)
+    ON CONFLICT (post_id) DO UPDATE SET likes = likes + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_like_delete AFTER DELETE ON post_like
+WHEN OLD.liked
+BEGIN
+  UPDATE post_stats SET likes = likes - 1 WHERE post_id = OLD.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_like_update AFTER UPDATE OF liked ON post_like
+WHEN OLD.liked IS NOT NEW.liked
+BEGIN
+  UPDATE post_stats SET likes = likes + (CASE WHEN NEW.liked THEN 1 ELSE -1 END)
+    WHERE post_id = NEW.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_comment_insert AFTER INSERT ON comment
+BEGIN
+  INSERT INTO post_stats (post_id, comments) VALUES (NEW.post_id, 1)
+    ON CONFLICT (post_id) DO UPDATE SET comments = comments + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_comment_delete AFTER DELETE ON comment
+BEGIN
+  UPDATE post_stats SET comments = comments - 1 WHERE post_id = OLD.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_image_insert AFTER INSERT ON image
+BEGIN
+  INSERT INTO post_stats (post_id, images) VALUES (NEW.post_id, 1)
+    ON CONFLICT (post_id) DO UPDATE SET images = images + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_stats_image_delete AFTER DELETE ON image
+BEGIN
+  UPDATE post_stats SET images = images - 1 WHERE post_id = OLD.post_id;
+END;
+
+-- Full-text index over posts; rowid is the post id. Filled here for existing
+-- posts, kept in sync by Post.create/update/delete and rebuilt by
+-- `flask rebuild-search-index`.
+CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5 (
+  title,
+  body,
+  tags,
+  tokenize = 'unicode61 remove_diacritics 2'
+);
+
+INSERT INTO post_search (rowid, title, body, tags)
+SELECT p.id, p.title, p.body,
+  (SELECT group_concat(t.name_tag, ' ') FROM post_tag pt
+    JOIN tags t ON pt.tags_id = t.id WHERE pt.post_id = p.id)
+FROM post p
+WHERE p.id NOT IN (SELECT rowid FROM post_search);
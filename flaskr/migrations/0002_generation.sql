@@ -0,0 +1,28 @@
+-- Write counters used to invalidate cached pages and feeds. Every change
+-- to a post bumps the 'posts' generation and its timestamp.
+
+CREATE TABLE IF NOT EXISTS generation (
+  name TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0,
+  updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO generation (name) VALUES ('posts');
+
+CREATE TRIGGER IF NOT EXISTS generation_post_insert AFTER INSERT ON post
+BEGIN
+  UPDATE generation SET value = value + 1, updated = CURRENT_TIMESTAMP
+    WHERE name = 'posts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS generation_post_update AFTER UPDATE ON post
+BEGIN
+  UPDATE generation SET value = value + 1, updated = CURRENT_TIMESTAMP
+    WHERE name = 'posts';
+END;
+
+CREATE TRIGGER IF NOT EXISTS generation_post_delete AFTER DELETE ON post
+BEGIN
+  UPDATE generation SET value = value + 1, updated = CURRENT_TIMESTAMP
+    WHERE name = 'posts';
+END;
@@ -0,0 +1,11 @@
+-- Resized and WebP copies of uploaded images, written by flaskr.images.
+
+CREATE TABLE IF NOT EXISTS image_variant (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  image_id INTEGER NOT NULL,
+  width INTEGER NOT NULL,
+  format TEXT NOT NULL,
+  path TEXT NOT NULL,
+  UNIQUE (image_id, width, format),
+  FOREIGN KEY (image_id) REFERENCES image (id)
+);
@@ -0,0 +1,27 @@
+-- Secondary indexes for the queries in flaskr/post.py and the routers, and
+-- the uniqueness the data model implies. Duplicates are merged first.
+
+-- one like per user and post
+DELETE FROM post_like WHERE id NOT IN (
+  SELECT MIN(id) FROM post_like GROUP BY post_id, user_id
+);
+CREATE UNIQUE INDEX IF NOT EXISTS post_like_post_user_idx ON post_like (post_id, user_id);
+
+-- one tag per name: point links at the oldest duplicate, then drop the rest
+UPDATE post_tag SET tags_id = (
+  SELECT MIN(t2.id) FROM tags t1 JOIN tags t2 ON t2.name_tag = t1.name_tag
+  WHERE t1.id = post_tag.tags_id
+);
+DELETE FROM tags WHERE id NOT IN (SELECT MIN(id) FROM tags GROUP BY name_tag);
+CREATE UNIQUE INDEX IF NOT EXISTS tags_name_tag_idx ON tags (name_tag);
+
+-- a post is linked to a tag at most once
+DELETE FROM post_tag WHERE id NOT IN (
+  SELECT MIN(id) FROM post_tag GROUP BY post_id, tags_id
+);
+CREATE UNIQUE INDEX IF NOT EXISTS post_tag_post_tags_idx ON post_tag (post_id, tags_id);
+CREATE INDEX IF NOT EXISTS post_tag_tags_post_idx ON post_tag (tags_id, post_id);
+
+CREATE INDEX IF NOT EXISTS comment_post_idx ON comment (post_id);
+
+CREATE INDEX IF NOT EXISTS image_post_idx ON image (post_id);
@@ -0,0 +1,36 @@
+-- Number of posts per tag and when the tag was last applied, maintained by
+-- triggers on post_tag. Powers the tag cloud without aggregating post_tag.
+
+CREATE TABLE IF NOT EXISTS tag_stats (
+  tags_id INTEGER PRIMARY KEY,
+  post_count INTEGER NOT NULL DEFAULT 0,
+  last_used TIMESTAMP,
+  FOREIGN KEY (tags_id) REFERENCES tags (id)
+);
+
+CREATE INDEX IF NOT EXISTS tag_stats_post_count_idx ON tag_stats (post_count);
+
+INSERT OR REPLACE INTO tag_stats (tags_id, post_count, last_used)
+SELECT t.id,
+  (SELECT COUNT(*) FROM post_tag WHERE tags_id = t.id),
+  (SELECT MAX(p.created) FROM post_tag pt JOIN post p ON p.id = pt.post_id
+    WHERE pt.tags_id = t.id)
+FROM tags t;
+
+CREATE TRIGGER IF NOT EXISTS tag_stats_post_tag_insert AFTER INSERT ON post_tag
+BEGIN
+  INSERT INTO tag_stats (tags_id, post_count, last_used)
+    VALUES (NEW.tags_id, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (tags_id) DO UPDATE SET
+      post_count = post_count + 1, last_used = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_stats_post_tag_delete AFTER DELETE ON post_tag
+BEGIN
+  UPDATE tag_stats SET post_count = post_count - 1 WHERE tags_id = OLD.tags_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_stats_tags_delete AFTER DELETE ON tags
+BEGIN
+  DELETE FROM tag_stats WHERE tags_id = OLD.id;
+END;
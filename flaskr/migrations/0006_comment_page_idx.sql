@@ -0,0 +1,6 @@
+-- Comments are paged newest first per post; this index serves both the
+-- filter and the (created, id) order, and replaces the post_id-only index.
+
+CREATE INDEX IF NOT EXISTS comment_post_created_idx ON comment (post_id, created, id);
+
+DROP INDEX IF EXISTS comment_post_idx;
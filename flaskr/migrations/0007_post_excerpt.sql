@@ -0,0 +1,10 @@
+-- The leading blocks of the rendered body, shown on listings. Written with
+-- post_html; rows of posts stored before this migration are filled in when
+-- a listing first shows them, or by `flask render-posts`.
+
+CREATE TABLE IF NOT EXISTS post_excerpt (
+  post_id INTEGER PRIMARY KEY,
+  excerpt TEXT NOT NULL,
+  truncated BOOLEAN NOT NULL DEFAULT FALSE,
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
@@ -0,0 +1,86 @@
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .log import init_logger
+
+
+logger = init_logger()
+
+
+class HashingBusy(Exception):
+    """Raised when PASSWORD_MAX_PENDING hashes are already waiting or running,
+    or when a hash did not finish within PASSWORD_TIMEOUT seconds."""
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a small pool of worker threads.
+
+    At most ``PASSWORD_WORKERS`` hashes run at once, so a burst of logins
+    cannot take every CPU away from page rendering, and at most
+    ``PASSWORD_MAX_PENDING`` may wait; beyond that HashingBusy is raised
+    at once instead of tying up another request thread. With
+    ``PASSWORD_WORKERS`` set to 0 hashing runs in the calling request.
+    """
+
+    def __init__(self, app):
+        self.method = app.config['PASSWORD_METHOD']
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        self.timeout = app.config['PASSWORD_TIMEOUT']
+        workers = app.config['PASSWORD_WORKERS']
+        self.executor = (
+            ThreadPoolExecutor(workers, thread_name_prefix='flaskr-passwords')
+            if workers > 0 else None
+        )
+        self.slots = threading.BoundedSemaphore(max(app.config['PASSWORD_MAX_PENDING'], 1))
+
+    def _run(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy('Too many password checks in progress.')
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # freed when the hash finishes or is dropped, not when the request
+        # stops waiting for it, so timed out hashes still count as pending
+        future.add_done_callback(lambda future: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # drops the job if no worker has started it yet
+            future.cancel()
+            raise HashingBusy('Password hashing timed out.')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    @functools.cached_property
+    def _params(self):
+        # werkzeug stores defaults it fills in, e.g. "scrypt" as
+        # "scrypt:32768:8:1", so compare with a hash made the current way
+        method, salt, _ = generate_password_hash('', self.method, self.salt_length).split('$')
+        return method, len(salt)
+
+    def needs_rehash(self, pwhash):
+        """Whether a stored hash was made with other parameters than configured."""
+        method, _, rest = pwhash.partition('$')
+        salt = rest.partition('$')[0]
+        return (method, len(salt)) != self._params
+
+
+def get_hasher(app=None):
+    app = app or current_app._get_current_object()
+    hasher = app.extensions.get('flaskr_passwords')
+    if hasher is None:
+        hasher = app.extensions['flaskr_passwords'] = PasswordHasher(app)
+    return hasher
@@ -1,13 +1,148 @@
+import base64
+import binascii
+import re
+import sqlite3
+
+import click
 from flask import g
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
 from werkzeug.exceptions import abort
 
-from .markdown import md
-from flaskr.db import get_db
+from .images import URL_PREFIX, get_pipeline
+from .markdown import content_hash, excerpt, html_cache, render
+from flaskr.db import bump_generation, get_db
+
+
+POSTS_COLUMNS = (
+    "p.id, p.title, p.body, p.created, p.author_id, username, "
+    "COALESCE(s.likes, 0) AS likes, COALESCE(s.comments, 0) AS comments, "
+    "COALESCE(s.images, 0) AS image, "
+    "(SELECT avatar_path FROM user WHERE id = p.author_id) AS avatar, "
+    # listings show the stored excerpt and never load the full HTML
+    "NULL AS html, h.body_hash, e.excerpt, COALESCE(e.truncated, FALSE) AS truncated "
+)
+
+POSTS_FROM = (
+    "FROM post p JOIN user u ON p.author_id = u.id "
+    "LEFT JOIN post_stats s ON s.post_id = p.id "
+    "LEFT JOIN post_html h ON h.post_id = p.id "
+    "LEFT JOIN post_excerpt e ON e.post_id = p.id "
+)
+
+POSTS_SELECT = "SELECT " + POSTS_COLUMNS + POSTS_FROM
+
+# snippet() markers, replaced by <mark> tags once the text is escaped
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+
+def encode_cursor(post):
+    """Return an opaque page token pointing at the (created, id) of a post."""
+    return _cursor(post.created, post.id)
+
+
+def _cursor(created, id):
+    raw = f"{created}|{id}".encode("utf8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created, id = raw.decode("utf8").rsplit("|", 1)
+        return created, int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, "Invalid page cursor.")
+
+
+def normalize_tags(tags):
+    """Split comma separated tag input into unique, trimmed tag names.
+
+    ``tags`` is a string or a list of strings, as sent by the post forms.
+    """
+    if isinstance(tags, str):
+        tags = [tags]
+    names = (" ".join(name.split()) for value in tags or () for name in value.split(","))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def fts_query(query):
+    """Turn free text into an FTS5 query of quoted prefix terms."""
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", query))
+
+
+def highlight(snippet):
+    return (
+        escape(snippet)
+        .replace(_MARK_START, Markup("<mark>"))
+        .replace(_MARK_END, Markup("</mark>"))
+    )
+
+
+def _search_result(row):
+    post = Post(*row[1:])
+    post.snippet = highlight(row["snippet"])
+    return post
+
+
+class PostStream:
+    """Posts read from a cursor while a template iterates over them.
+
+    Rows are fetched ``size`` at a time and the tags of each chunk are
+    loaded with one query, so memory does not grow with the number of
+    rows. ``rows`` is a cursor or an already loaded list. At most
+    ``limit`` posts are yielded; ``has_more`` tells whether there was
+    another row and, like the page cursors, is only known once iteration
+    has finished.
+    """
+
+    def __init__(self, rows, limit=None, size=50, make=None, has_prev=False, has_next=None):
+        self.rows = rows
+        self.limit = limit
+        self.size = size
+        self.make = make or (lambda row: Post(*row))
+        self.has_prev = has_prev
+        self._has_next = has_next
+        self.first = self.last = None
+        self.has_more = False
+
+    def _chunks(self):
+        if isinstance(self.rows, list):
+            for start in range(0, len(self.rows), self.size):
+                yield self.rows[start:start + self.size]
+        else:
+            yield from iter(lambda: self.rows.fetchmany(self.size), [])
+
+    def __iter__(self):
+        count = 0
+        for rows in self._chunks():
+            for post in Post.prefetch_tags([self.make(row) for row in rows]):
+                if count == self.limit:
+                    self.has_more = True
+                    return
+                count += 1
+                if self.first is None:
+                    self.first = post
+                self.last = post
+                yield post
+
+    @property
+    def has_next(self):
+        return self.has_more if self._has_next is None else self._has_next
+
+    @property
+    def prev_cursor(self):
+        return encode_cursor(self.first) if self.first and self.has_prev else None
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.last) if self.last and self.has_next else None
 
 
 class Post:
     def __init__(
-        self, id, title, body, created, author_id, username, likes, comments, image, avatar
+        self, id, title, body, created, author_id, username, likes, comments, image, avatar,
+        html=None, body_hash=None, excerpt=None, truncated=False
     ):
         self.id = id
         self.title = title
@@ -19,44 +154,195 @@ class Post:
         self.comments = comments
         self.image = image
         self.avatar = avatar
+        self.html = html
+        self.body_hash = body_hash
+        self.excerpt = excerpt
+        self.truncated = bool(truncated)
+        self._tags = None
 
     @property
     def tags(self):
-        db = get_db()
-        tags_data = db.execute(
-            "SELECT t.name_tag FROM post_tag pt JOIN "
-            "tags t ON pt.tags_id = t.id WHERE pt.post_id = ?",
-            (self.id,),
+        if self._tags is None:
+            db = get_db()
+            tags_data = db.execute(
+                "SELECT t.name_tag FROM post_tag pt JOIN "
+                "tags t ON pt.tags_id = t.id WHERE pt.post_id = ?",
+                (self.id,),
+            ).fetchall()
+            self._tags = [tag[0] for tag in tags_data]
+
+        return self._tags
+
+    @staticmethod
+    def prefetch_tags(posts):
+        """Load the tags of all given posts with a single query."""
+        by_id = {post.id: post for post in posts}
+        for post in by_id.values():
+            post._tags = []
+        if not by_id:
+            return posts
+
+        placeholders = ", ".join("?" * len(by_id))
+        tags_data = get_db().execute(
+            "SELECT pt.post_id, t.name_tag FROM post_tag pt JOIN "
+            "tags t ON pt.tags_id = t.id "
+            f"WHERE pt.post_id IN ({placeholders}) ORDER BY pt.id",
+            tuple(by_id),
         ).fetchall()
+        for post_id, name_tag in tags_data:
+            by_id[post_id]._tags.append(name_tag)
 
-        return [tag[0] for tag in tags_data]
+        return posts
 
     def get_posts(page, per_page):
         db = get_db()
         offset = (page - 1) * per_page
         posts_data = db.execute(
-            "SELECT p.id, title, body, created, author_id, username, "
-            "(SELECT COUNT(*) FROM post_like WHERE post_id = p.id AND liked = TRUE) AS likes, "
-            "(SELECT COUNT(*) FROM comment WHERE post_id = p.id) AS comments, "
-            "(SELECT COUNT(*) FROM image WHERE post_id = p.id) AS image, "
-            "(SELECT avatar_path FROM user WHERE id = p.author_id) AS avatar "
-            "FROM post p JOIN user u ON p.author_id = u.id "
-            "ORDER BY created DESC LIMIT ? OFFSET ?",
+            POSTS_SELECT + "ORDER BY p.created DESC, p.id DESC LIMIT ? OFFSET ?",
             (per_page, offset),
         ).fetchall()
 
-        return [Post(*post_data) for post_data in posts_data]
+        return Post.prefetch_tags([Post(*post_data) for post_data in posts_data])
+
+    @staticmethod
+    def paginate(per_page, before=None, after=None, joins="", where="", params=(), stream=False):
+        """Return a page of posts, newest first, using keyset pagination.
+
+        ``before`` and ``after`` are cursors from a previous call. The result
+        is ``(posts, prev_cursor, next_cursor)``; a cursor is None when there
+        is no page in that direction.
+
+        With ``stream``, the page is returned as a PostStream that carries
+        its own cursors instead. Pages read backwards have to be reversed
+        and so are loaded whole first.
+        """
+        conditions = [where] if where else []
+        params = tuple(params)
+        if before is not None:
+            conditions.append("(p.created, p.id) > (?, ?)")
+            params += decode_cursor(before)
+            order = "ASC"
+        else:
+            if after is not None:
+                conditions.append("(p.created, p.id) < (?, ?)")
+                params += decode_cursor(after)
+            order = "DESC"
+
+        where_sql = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        cursor = get_db().execute(
+            POSTS_SELECT + joins + where_sql
+            + f"ORDER BY p.created {order}, p.id {order} LIMIT ?",
+            params + (per_page + 1,),
+        )
+        if stream and before is None:
+            return PostStream(cursor, limit=per_page, has_prev=after is not None)
+
+        posts_data = cursor.fetchall()
+
+        has_more = len(posts_data) > per_page
+        posts_data = posts_data[:per_page]
+        if before is not None:
+            posts_data.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = after is not None, has_more
+
+        if stream:
+            return PostStream(posts_data, has_prev=has_prev, has_next=has_next)
+        posts = Post.prefetch_tags([Post(*post_data) for post_data in posts_data])
+        prev_cursor = encode_cursor(posts[0]) if posts and has_prev else None
+        next_cursor = encode_cursor(posts[-1]) if posts and has_next else None
+
+        return posts, prev_cursor, next_cursor
+
+    @staticmethod
+    def get(id):
+        """Return a single post with its tags, for callers that need no comments."""
+        post_data = get_db().execute(POSTS_SELECT + "WHERE p.id = ?", (id,)).fetchone()
+        if post_data is None:
+            abort(404, f"Post id {id} doesn't exist.")
+
+        return Post.prefetch_tags([Post(*post_data)])[0]
+
+    @staticmethod
+    def get_comments(id, per_page, after=None):
+        """Return ``(comments, next_cursor)`` of a post, newest first.
+
+        Comments are paged by keyset like posts; ``after`` is the cursor of
+        the previous page.
+        """
+        params = (id,)
+        after_sql = ""
+        if after is not None:
+            after_sql = "AND (c.created, c.id) < (?, ?) "
+            params += decode_cursor(after)
+
+        comments = get_db().execute(
+            "SELECT c.id, c.body, c.created, c.author_id, u.username "
+            "FROM comment c JOIN user u ON c.author_id = u.id "
+            "WHERE c.post_id = ? " + after_sql
+            + "ORDER BY c.created DESC, c.id DESC LIMIT ?",
+            params + (per_page + 1,),
+        ).fetchall()
+
+        next_cursor = None
+        if len(comments) > per_page:
+            comments = comments[:per_page]
+            next_cursor = _cursor(comments[-1]["created"], comments[-1]["id"])
+
+        return comments, next_cursor
+
+    @staticmethod
+    def search(query, page, per_page, stream=False):
+        """Return ``(posts, has_next)`` for a full-text query, best match first.
+
+        Every post carries a ``snippet`` with the matched terms highlighted.
+        With ``stream``, a PostStream is returned instead; its ``has_next``
+        is known once it has been iterated.
+        """
+        match = fts_query(query)
+        if not match:
+            return PostStream([]) if stream else ([], False)
+
+        cursor = get_db().execute(
+            "SELECT snippet(post_search, -1, ?, ?, '…', 24) AS snippet, "
+            + POSTS_COLUMNS + POSTS_FROM
+            + "JOIN post_search ON post_search.rowid = p.id "
+            "WHERE post_search MATCH ? "
+            "ORDER BY bm25(post_search, 10.0, 1.0, 5.0) LIMIT ? OFFSET ?",
+            (_MARK_START, _MARK_END, match, per_page + 1, (page - 1) * per_page),
+        )
+        if stream:
+            return PostStream(cursor, limit=per_page, make=_search_result)
+
+        posts_data = cursor.fetchall()
+        posts = [_search_result(post_data) for post_data in posts_data[:per_page]]
+        return Post.prefetch_tags(posts), len(posts_data) > per_page
+
+    @staticmethod
+    def index_search(db, id):
+        db.execute("DELETE FROM post_search WHERE rowid = ?", (id,))
+        db.execute(
+            "INSERT INTO post_search (rowid, title, body, tags) "
+            "SELECT p.id, p.title, p.body, "
+            "(SELECT group_concat(t.name_tag, ' ') FROM post_tag pt "
+            "JOIN tags t ON pt.tags_id = t.id WHERE pt.post_id = p.id) "
+            "FROM post p WHERE p.id = ?",
+            (id,),
+        )
 
     @staticmethod
-    def get_post(id, check_author=False):
+    def get_post(id, check_author=False, comments_per_page=20, comments_after=None):
         post = (
             get_db()
             .execute(
                 "SELECT p.id, title, body, created, author_id, username, "
-                "(SELECT COUNT(*) FROM post_like WHERE post_id = p.id AND liked = TRUE) AS likes, "
-                "(SELECT COUNT(*) FROM comment WHERE post_id = p.id) AS comments, "
-                "(SELECT image_path FROM image WHERE post_id = p.id LIMIT 1) AS image "
+                "COALESCE(s.likes, 0) AS likes, COALESCE(s.comments, 0) AS comments, "
+                "(SELECT image_path FROM image WHERE post_id = p.id ORDER BY id LIMIT 1) AS image, "
+                "u.avatar_path AS avatar, h.html, h.body_hash "
                 "FROM post p JOIN user u ON p.author_id = u.id "
+                "LEFT JOIN post_stats s ON s.post_id = p.id "
+                "LEFT JOIN post_html h ON h.post_id = p.id "
                 "WHERE p.id = ?",
                 (id,),
             )
@@ -69,100 +355,310 @@ class Post:
         if check_author and post["author_id"] != g.user["id"]:
             abort(403)
 
-        avatar = (
+        comments, comments_next = Post.get_comments(id, comments_per_page, comments_after)
+        variants = (
             get_db()
             .execute(
-                "SELECT avatar_path FROM user WHERE id = ?",
-                (post["author_id"],),
-            )
-            .fetchone()
-        )
-
-        comments = (
-            get_db()
-            .execute(
-                "SELECT c.id, body, created, author_id, username "
-                "FROM comment c JOIN user u ON c.author_id = u.id "
-                "WHERE post_id = ? "
-                "ORDER BY created DESC",
+                "SELECT path, width, format FROM image_variant "
+                "WHERE image_id = (SELECT id FROM image WHERE post_id = ? ORDER BY id LIMIT 1) "
+                "ORDER BY width",
                 (id,),
             )
             .fetchall()
         )
-        post_obj = Post(*post, avatar=avatar[0])
+        srcset = {}
+        for variant in variants:
+            kind = "webp" if variant["format"] == "webp" else "fallback"
+            srcset.setdefault(kind, []).append(f"{variant['path']} {variant['width']}w")
+
+        post_obj = Post(*post)
 
         return dict(
-            post=post_obj, comments=comments, tags=post_obj.tags, image=post_obj.image, avatar=avatar[0]
+            post=post_obj, comments=comments, comments_next=comments_next, tags=post_obj.tags, image=post_obj.image, avatar=post_obj.avatar,
+            srcset={kind: ", ".join(items) for kind, items in srcset.items()},
         )
 
     @property
     def body_html(self):
-        return md.convert(self.body)
+        body_hash = content_hash(self.body)
+        if self.html is not None and self.body_hash == body_hash:
+            return self.html
 
-    @classmethod
-    def create(cls, title, body, author_id, tags):
-        splitted = [x.strip() for x in tags[0].split(",")]
-        db = get_db()
+        html = html_cache.get(body_hash)
+        if html is None:
+            html = render(self.body)
+            html_cache.set(body_hash, html)
+            # lazily backfill rows written before HTML was stored, or
+            # rendered with a different set of Markdown extensions
+            try:
+                db = get_db()
+                Post.store_html(db, self.id, self.body, html)
+                db.commit()
+            except sqlite3.OperationalError:
+                pass
+
+        self.html, self.body_hash = html, body_hash
+        return html
+
+    @property
+    def excerpt_html(self):
+        if self.excerpt is not None and self.body_hash == content_hash(self.body):
+            return self.excerpt
+
+        html = self.body_html
+        self.excerpt, self.truncated = excerpt(html)
+        # lazily backfill rows stored before excerpts were
+        try:
+            db = get_db()
+            Post.store_html(db, self.id, self.body, html)
+            db.commit()
+        except sqlite3.OperationalError:
+            pass
+        return self.excerpt
+
+    @staticmethod
+    def get_body_html(id):
+        """Return the rendered body of a post without loading anything else."""
+        row = get_db().execute(
+            "SELECT p.body, h.html, h.body_hash FROM post p "
+            "LEFT JOIN post_html h ON h.post_id = p.id WHERE p.id = ?",
+            (id,),
+        ).fetchone()
+        if row is None:
+            abort(404, f"Post id {id} doesn't exist.")
+
+        post = Post(id, None, row["body"], None, None, None, 0, 0, 0, None,
+                    row["html"], row["body_hash"])
+        return post.body_html
+
+    @staticmethod
+    def prefetch_html(posts):
+        """Load the stored HTML of posts from a listing with a single query."""
+        by_id = {post.id: post for post in posts if post.html is None}
+        if by_id:
+            placeholders = ", ".join("?" * len(by_id))
+            for post_id, html, body_hash in get_db().execute(
+                f"SELECT post_id, html, body_hash FROM post_html WHERE post_id IN ({placeholders})",
+                tuple(by_id),
+            ).fetchall():
+                by_id[post_id].html, by_id[post_id].body_hash = html, body_hash
+        return posts
+
+    @staticmethod
+    def store_html(db, id, body, html=None):
+        body_hash = content_hash(body)
+        if html is None:
+            html = html_cache.get(body_hash)
+            if html is None:
+                html = render(body)
+                html_cache.set(body_hash, html)
         db.execute(
-            "INSERT INTO post (title, body, author_id)" " VALUES (?, ?, ?)",
-            (title, body, author_id),
+            "INSERT INTO post_html (post_id, body_hash, html) VALUES (?, ?, ?) "
+            "ON CONFLICT (post_id) DO UPDATE SET "
+            "body_hash = excluded.body_hash, html = excluded.html",
+            (id, body_hash, html),
+        )
+        db.execute(
+            "INSERT INTO post_excerpt (post_id, excerpt, truncated) VALUES (?, ?, ?) "
+            "ON CONFLICT (post_id) DO UPDATE SET "
+            "excerpt = excluded.excerpt, truncated = excluded.truncated",
+            (id, *excerpt(html)),
         )
-        db.commit()
 
-        post_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
-
-        for tag in splitted:
-            tag_info = db.execute(
-                "SELECT id FROM tags WHERE name_tag = ?", (tag,)
-            ).fetchone()
-            if tag_info is None:
-                db.execute("INSERT INTO tags (name_tag) VALUES (?)", (tag,))
-                tags_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
-            else:
-                tags_id = tag_info[0]
-            db.execute(
-                "INSERT INTO post_tag (post_id, tags_id) VALUES (?, ?)",
-                (post_id, tags_id),
-            )
+    @classmethod
+    def create(cls, title, body, author_id, tags, image=None):
+        """Save a new post, its tags and optional image in one transaction."""
+        db = get_db()
+        with db:
+            post_id = db.execute(
+                "INSERT INTO post (title, body, author_id)" " VALUES (?, ?, ?)",
+                (title, body, author_id),
+            ).lastrowid
+            Post.store_html(db, post_id, body)
+            Post.set_tags(db, post_id, tags)
+            Post.index_search(db, post_id)
+            if image is not None:
+                image_id = db.execute(
+                    "INSERT INTO image (post_id, image_path) VALUES (?, ?)",
+                    (post_id, URL_PREFIX + image),
+                ).lastrowid
 
-        db.commit()
+        if image is not None:
+            get_pipeline().submit(image_id, image)
 
         return post_id
 
     @classmethod
     def update(cls, id, title, body, tags):
         db = get_db()
-        db.execute(
-            "UPDATE post SET title = ?, body = ?" " WHERE id = ?", (title, body, id)
-        )
-        db.commit()
+        with db:
+            db.execute(
+                "UPDATE post SET title = ?, body = ?" " WHERE id = ?", (title, body, id)
+            )
+            Post.store_html(db, id, body)
+            Post.set_tags(db, id, tags)
+            Post.prune_tags(db)
+            Post.index_search(db, id)
+            bump_generation("posts", f"post:{id}", commit=False)
 
+    @staticmethod
+    def set_tags(db, id, tags):
+        """Replace the tags of a post, creating missing tags in bulk."""
+        names = normalize_tags(tags)
         db.execute("DELETE FROM post_tag WHERE post_id = ?", (id,))
+        if not names:
+            return
 
-        tags = tags.split(",")
-
-        for tag in tags:
-            tag = tag.strip()
-            tags_id = db.execute(
-                "SELECT id FROM tags WHERE name_tag = ?", (tag,)
-            ).fetchone()
-            if tags_id is None:
-                db.execute("INSERT INTO tags (name_tag) VALUES (?)", (tag,))
-                tags_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
-                db.execute(
-                    "INSERT INTO post_tag (post_id, tags_id) VALUES (?, ?)",
-                    (id, tags_id),
-                )
-            else:
-                db.execute(
-                    "INSERT INTO post_tag (post_id, tags_id) VALUES (?, ?)",
-                    (id, tags_id[0]),
-                )
+        db.executemany(
+            "INSERT INTO tags (name_tag) VALUES (?) ON CONFLICT (name_tag) DO NOTHING",
+            [(name,) for name in names],
+        )
+        db.executemany(
+            "INSERT INTO post_tag (post_id, tags_id) "
+            "SELECT ?, id FROM tags WHERE name_tag = ?",
+            [(id, name) for name in names],
+        )
+
+    @staticmethod
+    def prune_tags(db):
+        """Delete tags that are no longer used by any post."""
+        db.execute(
+            "DELETE FROM tags WHERE id IN "
+            "(SELECT tags_id FROM tag_stats WHERE post_count <= 0)"
+        )
 
+    @staticmethod
+    def top_tags(limit):
+        """Return the most used tags as (name_tag, post_count, last_used) rows."""
+        return get_db().execute(
+            "SELECT t.name_tag, s.post_count, s.last_used "
+            "FROM tag_stats s JOIN tags t ON t.id = s.tags_id "
+            "WHERE s.post_count > 0 "
+            "ORDER BY s.post_count DESC, t.name_tag LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    @classmethod
+    def toggle_like(cls, id, user_id):
+        """Like or unlike a post in one statement; return (liked, likes)."""
+        db = get_db()
+        try:
+            liked = db.execute(
+                "INSERT INTO post_like (user_id, post_id, liked) VALUES (?, ?, TRUE) "
+                "ON CONFLICT (post_id, user_id) DO UPDATE SET liked = NOT liked "
+                "RETURNING liked",
+                (user_id, id),
+            ).fetchone()[0]
+        except sqlite3.IntegrityError:
+            abort(404, f"Post id {id} doesn't exist.")
+        likes = db.execute(
+            "SELECT likes FROM post_stats WHERE post_id = ?", (id,)
+        ).fetchone()[0]
+        bump_generation("posts", f"post:{id}", commit=False)
         db.commit()
 
+        return bool(liked), likes
+
     @classmethod
     def delete(cls, id):
         db = get_db()
+        db.execute(
+            "DELETE FROM image_variant WHERE image_id IN "
+            "(SELECT id FROM image WHERE post_id = ?)",
+            (id,),
+        )
+        for table in ("post_like", "comment", "image", "post_tag", "post_html", "post_excerpt"):
+            db.execute(f"DELETE FROM {table} WHERE post_id = ?", (id,))
+        db.execute("DELETE FROM post_search WHERE rowid = ?", (id,))
         db.execute("DELETE FROM post WHERE id = ?", (id,))
+        Post.prune_tags(db)
+        bump_generation("posts", f"post:{id}", commit=False)
+        db.commit()
+
+
+@click.command('render-posts')
+@click.option('--chunk-size', default=200, show_default=True)
+@with_appcontext
+def render_posts_command(chunk_size):
+    """Re-render the stored HTML of every post."""
+    db = get_db()
+    html_cache.clear()
+    last_id, total = 0, 0
+    while True:
+        rows = db.execute(
+            "SELECT id, body FROM post WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, chunk_size),
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            Post.store_html(db, row["id"], row["body"])
+        # cached pages hold the HTML rendered before
+        bump_generation("posts", *(f"post:{row['id']}" for row in rows), commit=False)
+        db.commit()
+        last_id = rows[-1]["id"]
+        total += len(rows)
+    click.echo(f'Rendered {total} posts.')
+
+
+@click.command('reconcile-counters')
+@click.option('--chunk-size', default=500, show_default=True)
+@with_appcontext
+def reconcile_counters_command(chunk_size):
+    """Recompute the like, comment and image counters of every post."""
+    db = get_db()
+    last_id, total, fixed = 0, 0, 0
+    while True:
+        ids = db.execute(
+            "SELECT id FROM post WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, chunk_size),
+        ).fetchall()
+        if not ids:
+            break
+        changes = db.total_changes
+        db.execute(
+            "INSERT INTO post_stats (post_id, likes, comments, images) "
+            "SELECT p.id, "
+            "(SELECT COUNT(*) FROM post_like WHERE post_id = p.id AND liked = TRUE), "
+            "(SELECT COUNT(*) FROM comment WHERE post_id = p.id), "
+            "(SELECT COUNT(*) FROM image WHERE post_id = p.id) "
+            "FROM post p WHERE p.id BETWEEN ? AND ? "
+            "ON CONFLICT (post_id) DO UPDATE SET "
+            "likes = excluded.likes, comments = excluded.comments, images = excluded.images "
+            "WHERE likes != excluded.likes OR comments != excluded.comments "
+            "OR images != excluded.images",
+            (ids[0]["id"], ids[-1]["id"]),
+        )
         db.commit()
+        fixed += db.total_changes - changes
+        total += len(ids)
+        last_id = ids[-1]["id"]
+
+    db.execute("DELETE FROM post_stats WHERE post_id NOT IN (SELECT id FROM post)")
+    db.commit()
+    click.echo(f'Reconciled {total} posts, fixed {fixed}.')
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from scratch."""
+    db = get_db()
+    db.execute("DELETE FROM post_search")
+    db.execute(
+        "INSERT INTO post_search (rowid, title, body, tags) "
+        "SELECT p.id, p.title, p.body, "
+        "(SELECT group_concat(t.name_tag, ' ') FROM post_tag pt "
+        "JOIN tags t ON pt.tags_id = t.id WHERE pt.post_id = p.id) "
+        "FROM post p"
+    )
+    db.execute("INSERT INTO post_search (post_search) VALUES ('optimize')")
+    db.commit()
+    count = db.execute("SELECT COUNT(*) FROM post_search").fetchone()[0]
+    click.echo(f'Indexed {count} posts.')
+
+
+def init_app(app):
+    app.cli.add_command(render_posts_command)
+    app.cli.add_command(reconcile_counters_command)
+    app.cli.add_command(rebuild_search_index_command)
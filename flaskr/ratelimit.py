@@ -0,0 +1,137 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request, session
+from werkzeug.exceptions import TooManyRequests
+
+from .log import init_logger
+
+
+logger = init_logger()
+
+# seconds between deletions of idle buckets by each process
+PRUNE_INTERVAL = 60
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS bucket ("
+    " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS rejected ("
+    " endpoint TEXT PRIMARY KEY, count INTEGER NOT NULL DEFAULT 0)",
+)
+
+
+class RateLimiter:
+    """Token buckets kept in an SQLite file shared by every worker process.
+
+    The file is separate from the blog database, so counting requests
+    never waits for, or holds, the blog's write lock. Each bucket is
+    refilled and charged by a single UPSERT, which SQLite applies
+    atomically across processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pruned = 0.0
+        self._local = threading.local()
+
+    def connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            # buckets are cheap to lose, so there is no need to wait for fsync
+            db.execute('PRAGMA journal_mode = wal')
+            db.execute('PRAGMA synchronous = off')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def hit(self, key, capacity, period, now=None):
+        """Take a token from a bucket; return 0, or the seconds until one is free."""
+        now = time.time() if now is None else now
+        rate = capacity / period
+        db = self.connect()
+        row = db.execute(
+            "INSERT INTO bucket (key, tokens, updated) VALUES (?1, ?2 - 1, ?3) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "tokens = min(?2, tokens + (?3 - updated) * ?4) - 1, updated = ?3 "
+            "WHERE min(?2, tokens + (?3 - updated) * ?4) >= 1 "
+            "RETURNING tokens",
+            (key, capacity, now, rate),
+        ).fetchone()
+        if row is not None:
+            return 0
+
+        row = db.execute(
+            'SELECT tokens, updated FROM bucket WHERE key = ?', (key,)
+        ).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * rate) if row else 0
+        return max((1 - tokens) / rate, 0.001)
+
+    def prune(self, max_period, now=None):
+        """Delete buckets untouched for ``max_period`` seconds.
+
+        Every bucket refills completely within its period, and a full
+        bucket behaves exactly like a missing one.
+        """
+        now = time.time() if now is None else now
+        self.pruned = now
+        return self.connect().execute(
+            'DELETE FROM bucket WHERE updated < ?', (now - max_period,)
+        ).rowcount
+
+    def reject(self, endpoint):
+        self.connect().execute(
+            'INSERT INTO rejected (endpoint, count) VALUES (?, 1) '
+            'ON CONFLICT (endpoint) DO UPDATE SET count = count + 1',
+            (endpoint,),
+        )
+
+    def stats(self):
+        if not os.path.exists(self.path):
+            return {}
+        return dict(self.connect().execute('SELECT endpoint, count FROM rejected').fetchall())
+
+
+def get_limiter(app=None):
+    app = app or current_app
+    limiter = app.extensions.get('flaskr_ratelimit')
+    if limiter is None:
+        limiter = app.extensions['flaskr_ratelimit'] = RateLimiter(
+            app.config['RATE_LIMIT_DATABASE']
+        )
+    return limiter
+
+
+def client_key():
+    """Logged in users are limited per account, everyone else per address."""
+    user_id = session.get('user_id')
+    return f'user:{user_id}' if user_id is not None else f'ip:{request.remote_addr}'
+
+
+def check_rate_limit():
+    limit = current_app.config['RATE_LIMITS'].get(request.endpoint)
+    if limit is None:
+        return
+    capacity, period, *methods = limit
+    if methods and request.method not in methods[0]:
+        return
+
+    limiter = get_limiter()
+    if time.time() - limiter.pruned >= PRUNE_INTERVAL:
+        limiter.prune(max(other[1] for other in current_app.config['RATE_LIMITS'].values()))
+
+    key = client_key()
+    wait = limiter.hit(f'{request.endpoint}:{key}', capacity, period)
+    if wait:
+        limiter.reject(request.endpoint)
+        logger.info(f'Rate limited {key} on {request.endpoint}')
+        raise TooManyRequests(retry_after=math.ceil(wait))
+
+
+def init_app(app):
+    app.before_request(check_rate_limit)
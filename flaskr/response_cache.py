@@ -0,0 +1,203 @@
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from flask import Response, current_app, g, request, session
+
+from .cache import LRUCache
+from flaskr.db import get_generations
+
+
+class MemoryBackend:
+    """Keeps responses in an LRU inside each worker process."""
+
+    def __init__(self, maxsize):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, entry):
+        self._cache.set(key, entry)
+
+
+class DiskBackend:
+    """Keeps responses as files in a directory shared by all workers.
+
+    Every ``PRUNE_EVERY`` writes of a process, files beyond the ``maxsize``
+    most recently written are removed. Entries of stale generations and of
+    one-off query strings are never read again, so they age out this way.
+    """
+
+    PRUNE_EVERY = 32
+
+    def __init__(self, directory, maxsize):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            try:
+                files.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                # removed by another worker meanwhile
+                continue
+        files.sort(reverse=True)
+        for _, path in files[self.maxsize:]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+BACKENDS = {
+    'memory': lambda app: MemoryBackend(app.config['RESPONSE_CACHE_SIZE']),
+    'disk': lambda app: DiskBackend(
+        app.config['RESPONSE_CACHE_DIR'], app.config['RESPONSE_CACHE_SIZE']
+    ),
+}
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+        }
+
+
+def get_response_cache(app=None):
+    """Return the configured ResponseCache, or None when caching is off."""
+    app = app or current_app
+    if 'flaskr_response_cache' not in app.extensions:
+        name = app.config['RESPONSE_CACHE']
+        app.extensions['flaskr_response_cache'] = (
+            ResponseCache(BACKENDS[name](app)) if name else None
+        )
+    return app.extensions['flaskr_response_cache']
+
+
+def cache_stats(app):
+    cache = get_response_cache(app)
+    return cache.stats() if cache is not None else {}
+
+
+def _generation_names(kwargs):
+    # a post page only changes with its own post; listings with any post
+    if 'id' in kwargs:
+        return (f'post:{kwargs["id"]}',)
+    return ('posts',)
+
+
+def _cacheable_headers(response):
+    return [
+        (name, value) for name, value in response.headers
+        if name.lower() not in ('set-cookie', 'content-length')
+    ]
+
+
+def _store_streamed(cache, key, generation, headers, chunks):
+    body = []
+    for chunk in chunks:
+        body.append(chunk if isinstance(chunk, bytes) else chunk.encode('utf8'))
+        yield chunk
+    body = b''.join(body)
+    etag = hashlib.sha256(body).hexdigest()
+    cache.backend.set(key, (generation, 200, headers + [('ETag', f'"{etag}"')], body))
+
+
+def cached(view):
+    """Serve anonymous GETs of a view from the response cache.
+
+    An entry is reused while the write generation it was rendered at is
+    current, and answers If-None-Match with 304 through a strong ETag.
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        cache = get_response_cache()
+        if (
+            cache is None
+            or request.method not in ('GET', 'HEAD')
+            or g.user is not None
+            or 'user_id' in session
+            or session.get('_flashes')
+        ):
+            return view(**kwargs)
+
+        generation = get_generations(_generation_names(kwargs))
+        # views such as blog.tags answer JSON or HTML depending on Accept
+        key = f'{request.host}{request.full_path} {request.accept_mimetypes.best}'
+        entry = cache.backend.get(key)
+
+        if entry is not None and entry[0] == generation:
+            cache.count('hits')
+            _, status, headers, body = entry
+            response = Response(body, status=status, headers=headers)
+        else:
+            cache.count('misses')
+            response = current_app.make_response(view(**kwargs))
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                # stored once the last chunk has been sent; only later hits
+                # can carry an ETag
+                response.response = _store_streamed(
+                    cache, key, generation, _cacheable_headers(response), response.response
+                )
+                response.vary.add('Cookie')
+                return response
+            response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+            cache.backend.set(
+                key, (generation, 200, _cacheable_headers(response), response.get_data())
+            )
+
+        response.vary.add('Cookie')
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            cache.count('not_modified')
+        return response
+
+    return wrapped_view
+
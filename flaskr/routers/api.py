@@ -0,0 +1,141 @@
+import json
+
+from flask import Blueprint, current_app, request, url_for
+from werkzeug.exceptions import HTTPException, abort
+
+from ..post import Post
+from flaskr.db import get_db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+MAX_LIMIT = 100
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+POST_FIELDS = {
+    "id": lambda post: post.id,
+    "title": lambda post: post.title,
+    "body": lambda post: post.body,
+    "html": lambda post: post.body_html,
+    "created": lambda post: _iso(post.created),
+    "url": lambda post: url_for("blog.post", id=post.id, _external=True),
+}
+
+DEFAULT_FIELDS = ("id", "title", "body", "created", "url")
+
+INCLUDES = {
+    "tags": lambda post: post.tags,
+    "counts": lambda post: dict(likes=post.likes, comments=post.comments, images=post.image),
+    "author": lambda post: dict(id=post.author_id, username=post.username, avatar=post.avatar),
+}
+
+
+def to_json(data, status=200):
+    """Serialize with orjson when it is installed, the json module otherwise."""
+    if orjson is not None:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+def _names(arg, allowed, default=()):
+    value = request.args.get(arg)
+    if value is None:
+        return default
+    names = tuple(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        abort(400, f"Unknown {arg}: {', '.join(unknown)}.")
+    return names
+
+
+def _limit():
+    return min(max(request.args.get("limit", current_app.config["POSTS_PER_PAGE"], type=int), 1),
+               MAX_LIMIT)
+
+
+def serialize(posts):
+    """Return the requested fields and includes of posts as dicts.
+
+    Everything included comes from the rows the listing already loaded and
+    from one batched tag query, never from a query per post.
+    """
+    fields = _names("fields", POST_FIELDS, DEFAULT_FIELDS)
+    includes = _names("include", INCLUDES)
+    if "html" in fields:
+        Post.prefetch_html(posts)
+    return [
+        {
+            **{name: POST_FIELDS[name](post) for name in fields},
+            **{name: INCLUDES[name](post) for name in includes},
+        }
+        for post in posts
+    ]
+
+
+@bp.errorhandler(HTTPException)
+def error(e):
+    response = to_json(dict(error=dict(status=e.code, message=e.description)), e.code)
+    # keep what the exception adds, such as Retry-After or Allow
+    for name, value in e.get_response().headers:
+        if name.lower() not in ("content-type", "content-length"):
+            response.headers.add(name, value)
+    return response
+
+
+@bp.route("/posts")
+def posts():
+    posts, prev_cursor, next_cursor = Post.paginate(
+        _limit(), before=request.args.get("before"), after=request.args.get("after")
+    )
+    return to_json(dict(data=serialize(posts), prev=prev_cursor, next=next_cursor))
+
+
+@bp.route("/posts/<int:id>")
+def post(id):
+    return to_json(dict(data=serialize([Post.get(id)])[0]))
+
+
+@bp.route("/posts/<int:id>/comments")
+def comments(id):
+    if get_db().execute("SELECT 1 FROM post WHERE id = ?", (id,)).fetchone() is None:
+        abort(404, f"Post id {id} doesn't exist.")
+
+    comments, next_cursor = Post.get_comments(id, _limit(), after=request.args.get("after"))
+    return to_json(dict(
+        data=[
+            dict(id=c["id"], body=c["body"], created=_iso(c["created"]),
+                 author=dict(id=c["author_id"], username=c["username"]))
+            for c in comments
+        ],
+        next=next_cursor,
+    ))
+
+
+@bp.route("/tags")
+def tags():
+    return to_json(dict(data=[
+        dict(name=name, posts=count, last_used=_iso(last_used))
+        for name, count, last_used in Post.top_tags(_limit())
+    ]))
+
+
+@bp.route("/search")
+def search():
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    posts, has_next = Post.search(query, page, _limit())
+    data = serialize(posts)
+    for item, post in zip(data, posts):
+        item["snippet"] = str(post.snippet)
+    return to_json(dict(data=data, page=page, next=page + 1 if has_next else None))
@@ -2,12 +2,14 @@ import functools
 import os
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, abort, current_app, flash, g, redirect, render_template, request, session,
+    url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
+from ..cache import LRUCache
 from ..log import init_logger
+from ..passwords import HashingBusy, get_hasher
 from flaskr.db import get_db
 
 
@@ -50,7 +52,7 @@ def register():
                 db = get_db()
                 db.execute(
                     "INSERT INTO user (username, password, avatar_path) VALUES (?, ?, ?)",
-                    (username, generate_password_hash(password), filename),
+                    (username, hash_password(password), filename),
                 )
                 db.commit()
             except db.IntegrityError:
@@ -76,10 +78,21 @@ def login():
 
         if user is None:
             error = 'Incorrect username.'
-        elif not check_password_hash(user['password'], password):
+        elif not check_password(user['password'], password):
             error = 'Incorrect password.'
 
         if error is None:
+            if get_hasher().needs_rehash(user['password']):
+                # upgrade the stored hash to the configured parameters while
+                # the plain password is at hand
+                db.execute(
+                    'UPDATE user SET password = ? WHERE id = ?',
+                    (hash_password(password), user['id']),
+                )
+                db.commit()
+                invalidate_user(user['id'])
+                logger.info(f'Rehashed the password of user {user["id"]}')
+
             session.clear()
             session['user_id'] = user['id']
 
@@ -92,16 +105,60 @@ def login():
     return render_template('auth/login.html')
 
 
+def hash_password(password):
+    try:
+        return get_hasher().hash(password)
+    except HashingBusy:
+        abort(503)
+
+
+def check_password(pwhash, password):
+    try:
+        return get_hasher().check(pwhash, password)
+    except HashingBusy:
+        abort(503)
+
+
+def get_user_cache(app=None):
+    app = app or current_app
+    cache = app.extensions.get('flaskr_user_cache')
+    if cache is None:
+        cache = app.extensions['flaskr_user_cache'] = LRUCache(
+            maxsize=app.config['USER_CACHE_SIZE'],
+            ttl=app.config['USER_CACHE_TTL'],
+        )
+    return cache
+
+
+def invalidate_user(user_id):
+    """Drop a cached user; call whenever a row of the user table changes."""
+    get_user_cache().pop(user_id)
+
+
 @bp.before_app_request
 def load_logged_in_user():
-    user_id = session.get('user_id')
+    # checked before the session is read, so that shared caches do not see
+    # these responses vary by cookie
+    if request.endpoint in current_app.config['USER_SKIP_ENDPOINTS']:
+        g.user = None
+        return
 
+    user_id = session.get('user_id')
     if user_id is None:
         g.user = None
-    else:
-        g.user = get_db().execute(
-            'SELECT * FROM user WHERE id = ?', (user_id,)
+        return
+
+    cache = get_user_cache()
+    user = cache.get(user_id)
+    if user is None:
+        row = get_db().execute(
+            'SELECT id, username, avatar_path FROM user WHERE id = ?', (user_id,)
         ).fetchone()
+        if row is not None:
+            user = dict(row)
+            cache.set(user_id, user)
+
+    g.user = user
 
 
 @bp.route('/logout')
@@ -1,13 +1,19 @@
-import os
+import hashlib
+import sqlite3
 
 from datetime import datetime
-from flask import Blueprint, flash, g, make_response, redirect, render_template, request, url_for
-from werkzeug.utils import secure_filename
-
-from ..post import Post
+from flask import (
+    Blueprint, Response, abort, current_app, flash, g, jsonify, make_response,
+    redirect, render_template, request, stream_template, url_for
+)
+
+from ..cache import LRUCache
+from ..images import save_upload
+from ..post import Post, encode_cursor
+from ..response_cache import cached
 from ..log import init_logger
 from flaskr.routers.auth import login_required
-from flaskr.db import get_db
+from flaskr.db import bump_generation, get_db, get_generation, iter_rows
 
 
 logger = init_logger()
@@ -15,26 +21,72 @@ logger = init_logger()
 bp = Blueprint("blog", __name__)
 
 
+def get_feed_cache(app=None):
+    """Rendered RSS feeds of an app, keyed by the posts generation they were built from."""
+    app = app or current_app
+    cache = app.extensions.get("flaskr_feed_cache")
+    if cache is None:
+        cache = app.extensions["flaskr_feed_cache"] = LRUCache(maxsize=8)
+    return cache
+
+
 @bp.route("/")
+@cached
 def index():
-    page = request.args.get("page", 1, type=int)
-    per_page = 5
-    posts = Post.get_posts(page, per_page)
+    per_page = current_app.config["POSTS_PER_PAGE"]
+    page = request.args.get("page", type=int)
+
+    if page is not None and page > 1:
+        if page > current_app.config["POSTS_LEGACY_PAGES"]:
+            return redirect(url_for("blog.index"))
+        posts = Post.get_posts(page, per_page)
+        prev_cursor = encode_cursor(posts[0]) if posts else None
+        next_cursor = encode_cursor(posts[-1]) if len(posts) >= per_page else None
+    else:
+        posts, prev_cursor, next_cursor = Post.paginate(
+            per_page,
+            before=request.args.get("before"),
+            after=request.args.get("after"),
+        )
 
-    logger.debug(f'Page number: {page}')
+    logger.debug(f'Page cursors: {prev_cursor}, {next_cursor}')
 
     return render_template(
-        "blog/index.html", posts=posts, current_page=page, per_page=per_page
+        "blog/index.html", posts=posts, prev_cursor=prev_cursor, next_cursor=next_cursor
     )
 
 
 @bp.route("/<int:id>")
+@cached
 def post(id):
-    post = Post.get_post(id)
+    post = Post.get_post(
+        id,
+        comments_per_page=current_app.config["COMMENTS_PER_PAGE"],
+        comments_after=request.args.get("comments_after"),
+    )
     logger.debug(f'Post opened: {post}')
     return render_template("blog/post.html", post=post)
 
 
+@bp.route("/<int:id>/body")
+@cached
+def body(id):
+    """Return the full rendered body of a post, for expand.js."""
+    return Post.get_body_html(id)
+
+
+@bp.route("/<int:id>/comments")
+@cached
+def comments(id):
+    """Render one more page of comments, for comments.js to append."""
+    comments, next_cursor = Post.get_comments(
+        id, current_app.config["COMMENTS_PER_PAGE"], after=request.args.get("after")
+    )
+    return render_template(
+        "blog/_comments.html", post_id=id, comments=comments, comments_next=next_cursor
+    )
+
+
 @bp.route("/create", methods=("GET", "POST"))
 @login_required
 def create():
@@ -48,27 +100,18 @@ def create():
         if error is not None:
             flash(error)
         else:
-            post_id = Post.create(title, body, g.user["id"], tags)
-            if "image" not in request.files:
-                flash("No file part")
-                return redirect(request.url)
-            file = request.files["image"]
-            if file.filename == "":
-                pass
-            if file:
-                filename = secure_filename(file.filename)
-                file.save(os.path.join("flaskr/static/images", filename))
-
+            file = request.files.get("image")
+            filename = save_upload(file) if file else None
+            if filename is not None:
                 logger.debug(f'Image file saved: {filename}')
 
-                db = get_db()
-                db.execute(
-                    "INSERT INTO image (post_id, image_path) VALUES (?, ?)",
-                    (post_id, "/static/images/" + filename),
-                )
-                db.commit()
+            post_id = Post.create(title, body, g.user["id"], tags, image=filename)
+
+            logger.debug(f'Post {post_id} saved into database')
 
-                logger.debug(f'Post saved into database: {db}')
+            if "image" not in request.files:
+                flash("No file part")
+                return redirect(request.url)
 
             return redirect(url_for("blog.index"))
 
@@ -92,28 +135,13 @@ def update(id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
             Post.update(id, title, body, tags)
-
-            tags_id = []
-            for tag in tags:
-                tag_id = db.execute(
-                    "SELECT id FROM tags WHERE name_tag = ?", (tag,)
-                ).fetchone()
-                if tag_id is not None:
-                    tags_id.append(tag_id[0])
-                else:
-                    db.execute("INSERT INTO tags (name_tag) VALUES (?)", (tag,))
-                    tags_id.append(
-                        db.execute("SELECT last_insert_rowid()").fetchone()[0]
-                    )
-
             return redirect(url_for("blog.index"))
 
     return render_template("blog/update.html", post=post)
 
 
-@bp.route("/<int:id>/delete", methods=("GET", "POST"))
+@bp.route("/<int:id>/delete", methods=("POST",))
 @login_required
 def delete(id):
     Post.get_post(id, check_author=True)
@@ -124,28 +152,12 @@ def delete(id):
 @bp.route("/<int:id>/like", methods=("POST",))
 @login_required
 def like(id):
-    db = get_db()
-    existing_like = db.execute(
-        "SELECT * FROM post_like WHERE user_id = ? AND post_id = ?", (g.user["id"], id)
-    ).fetchone()
-
-    if existing_like is not None:
-        db.execute(
-            "DELETE FROM post_like WHERE user_id = ? AND post_id = ?",
-            (g.user["id"], id),
-        )
-    else:
-        db.execute(
-            "INSERT INTO post_like(user_id, post_id, liked) VALUES(?, ?, TRUE)",
-            (g.user["id"], id),
-        )
+    liked, likes = Post.toggle_like(id, g.user["id"])
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(liked=liked, likes=likes)
 
-    db.commit()
     post = Post.get_post(id)
-    post = dict(post)
-    post["likes"] = db.execute(
-        "SELECT COUNT(*) FROM post_like WHERE post_id = ? AND liked = TRUE", (id,)
-    ).fetchone()[0]
     return render_template("blog/post.html", post=post)
 
 
@@ -162,73 +174,111 @@ def comment(id):
         flash(error)
     else:
         db = get_db()
-        db.execute(
-            "INSERT INTO comment (body, created, author_id, post_id)"
-            " VALUES (?, ?, ?, ?)",
-            (body, datetime.now(), g.user["id"], id),
-        )
+        try:
+            db.execute(
+                "INSERT INTO comment (body, created, author_id, post_id)"
+                " VALUES (?, ?, ?, ?)",
+                (body, datetime.now(), g.user["id"], id),
+            )
+        except sqlite3.IntegrityError:
+            abort(404, f"Post id {id} doesn't exist.")
+        bump_generation("posts", f"post:{id}", commit=False)
         db.commit()
         return redirect(url_for("blog.post", id=id))
 
 
 @bp.route("/tag/<string:tag>")
+@cached
 def tag(tag):
-    db = get_db()
-    posts_data = db.execute(
-        "SELECT p.id, title, body, created, author_id, username, "
-        "(SELECT COUNT(*) FROM post_like WHERE post_id = p.id AND liked = TRUE) AS likes, "
-        "(SELECT COUNT(*) FROM comment WHERE post_id = p.id) AS comments, "
-        "(SELECT image_path FROM image WHERE post_id = p.id LIMIT 1) AS image, "
-        "(SELECT avatar_path FROM user WHERE id = p.author_id) AS avatar "
-        "FROM post p JOIN user u ON p.author_id = u.id "
-        "JOIN post_tag pt ON p.id = pt.post_id "
-        "JOIN tags t ON pt.tags_id = t.id "
-        "WHERE t.name_tag = ? "
-        "ORDER BY created DESC",
-        (tag,),
-    ).fetchall()
-
-    return render_template(
-        "blog/tag.html",
-        posts=[Post(*post_data) for post_data in posts_data],
-        tag=tag, 
+    posts = Post.paginate(
+        current_app.config["POSTS_PER_PAGE"],
+        before=request.args.get("before"),
+        after=request.args.get("after"),
+        joins="JOIN post_tag pt ON p.id = pt.post_id JOIN tags t ON pt.tags_id = t.id ",
+        where="t.name_tag = ?",
+        params=(tag,),
+        stream=True,
     )
 
+    return Response(stream_template("blog/tag.html", posts=posts, tag=tag))
+
+
+@bp.route("/tags")
+@cached
+def tags():
+    top = Post.top_tags(current_app.config["TAG_CLOUD_SIZE"])
 
-@bp.route("/search", methods=("POST",))
+    if request.accept_mimetypes.best == "application/json":
+        response = jsonify([dict(name=name, posts=count) for name, count, _ in top])
+        response.vary.add("Accept")
+        return response
+
+    counts = [row["post_count"] for row in top]
+    low, high = min(counts, default=0), max(counts, default=0)
+    cloud = [
+        dict(name=row["name_tag"], posts=row["post_count"],
+             weight=(row["post_count"] - low) / (high - low) if high > low else 0.5)
+        for row in sorted(top, key=lambda row: row["name_tag"])
+    ]
+
+    response = make_response(render_template("blog/tags.html", tags=cloud))
+    response.vary.add("Accept")
+    return response
+
+
+@bp.route("/search", methods=("GET", "POST"))
 def search():
-    query = request.form["query"]
-    db = get_db()
-    posts_data = db.execute(
-        "SELECT p.id, title, body, created, author_id, username, "
-        "(SELECT COUNT(*) FROM post_like WHERE post_id = p.id AND liked = TRUE) AS likes, "
-        "(SELECT COUNT(*) FROM comment WHERE post_id = p.id) AS comments, "
-        "(SELECT COUNT(*) FROM image WHERE post_id = p.id) AS image, "
-        "(SELECT avatar_path FROM user WHERE id = p.author_id) AS avatar "
-        "FROM post p JOIN user u ON p.author_id = u.id "
-        "WHERE title LIKE ?",
-        ("%" + query + "%",),
-    ).fetchall()
+    # the old search form POSTs "query"; links and the current form use GET
+    query = request.values.get("q", request.values.get("query", "")).strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    posts = Post.search(query, page, current_app.config["POSTS_PER_PAGE"], stream=True)
 
-    return render_template(
-        "blog/search.html",
-        posts=[Post(*post_data) for post_data in posts_data],
-        query=query,
-    )
+    logger.debug(f'Search {query!r}, page {page}')
+
+    return Response(stream_template("blog/search.html", posts=posts, query=query, page=page))
 
 
 @bp.route('/rss')
+@cached
 def rss():
-    db = get_db()
-    posts = db.execute(
-        'SELECT p.id, p.title, p.body, p.created, u.username '
-        'FROM post p JOIN user u ON p.author_id = u.id '
-        'ORDER BY p.created DESC'
-    ).fetchall()
-    xml = render_template('rss.xml', posts=posts)
+    generation, updated = get_generation('posts')
+    limit = current_app.config['RSS_ITEMS']
+    key = (generation, limit, request.url_root)
+
+    feed_cache = get_feed_cache()
+    xml = feed_cache.get(key)
+    if xml is None:
+        cursor = get_db().execute(
+            'SELECT p.id, p.title, p.body, p.created, u.username '
+            'FROM post p JOIN user u ON p.author_id = u.id '
+            'ORDER BY p.created DESC, p.id DESC LIMIT ?',
+            (limit,),
+        )
+        xml = render_template('rss.xml', posts=iter_rows(cursor))
+        feed_cache.set(key, xml)
+
     response = make_response(xml)
     response.headers['Content-Type'] = 'application/rss+xml'
-    return response
+    response.set_etag(hashlib.sha1(repr(key).encode('utf8')).hexdigest())
+    if updated is not None:
+        response.last_modified = updated
+    return response.make_conditional(request)
+
+
+@bp.route('/rss/archive')
+def rss_archive():
+    if not current_app.config['RSS_ARCHIVE']:
+        abort(404)
+
+    cursor = get_db().execute(
+        'SELECT p.id, p.title, p.body, p.created, u.username '
+        'FROM post p JOIN user u ON p.author_id = u.id '
+        'ORDER BY p.created DESC, p.id DESC'
+    )
+    return Response(
+        stream_template('rss.xml', posts=iter_rows(cursor)),
+        headers={'Content-Type': 'application/rss+xml'},
+    )
 
 
 def validate_post(title, body):
@@ -0,0 +1,15 @@
+from flask import Blueprint, current_app, jsonify
+
+
+bp = Blueprint('stats', __name__, url_prefix='/stats')
+
+
+def register(app, name, provider):
+    """Expose the dict returned by ``provider()`` under ``name`` at /stats/."""
+    app.extensions.setdefault('flaskr_stats', {})[name] = provider
+
+
+@bp.route('/')
+def index():
+    providers = current_app.extensions.get('flaskr_stats', {})
+    return jsonify({name: provider() for name, provider in providers.items()})
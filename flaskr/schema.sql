@@ -1,62 +0,0 @@
--- DROP TABLE IF EXISTS user;
--- DROP TABLE IF EXISTS post;
--- DROP TABLE IF EXISTS post_like;
--- DROP TABLE IF EXISTS comment;
--- DROP TABLE IF EXISTS post_tag;
--- DROP TABLE IF EXISTS tags;
--- DROP TABLE IF EXISTS image;
-
-CREATE TABLE IF NOT EXISTS user (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  username TEXT UNIQUE NOT NULL,
-  password TEXT NOT NULL,
-  avatar_path TEXT
-);
-
-CREATE TABLE IF NOT EXISTS post (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  author_id INTEGER NOT NULL,
-  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  title TEXT NOT NULL,
-  body TEXT NOT NULL,
-  FOREIGN KEY (author_id) REFERENCES user (id)
-);
-
-CREATE TABLE IF NOT EXISTS post_like (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  user_id INTEGER NOT NULL,
-  post_id INTEGER NOT NULL,
-  liked BOOLEAN NOT NULL DEFAULT FALSE,
-  FOREIGN KEY (user_id) REFERENCES user (id),
-  FOREIGN KEY (post_id) REFERENCES post (id)
-);
-
-CREATE TABLE IF NOT EXISTS comment (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  author_id INTEGER NOT NULL,
-  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  post_id INTEGER NOT NULL,
-  body TEXT NOT NULL,
-  FOREIGN KEY (author_id) REFERENCES user (id),
-  FOREIGN KEY (post_id) REFERENCES post (id)
-);
-
-CREATE TABLE IF NOT EXISTS post_tag (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  post_id INTEGER NOT NULL,
-  tags_id INTEGER NOT NULL,
-  FOREIGN KEY (post_id) REFERENCES post (id),
-  FOREIGN KEY (tags_id) REFERENCES tags (id)
-);
-
-CREATE TABLE IF NOT EXISTS tags (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  name_tag TEXT NOT NULL
-);
-
-CREATE TABLE IF NOT EXISTS image (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  post_id INTEGER NOT NULL,
-  image_path TEXT NOT NULL,
-  FOREIGN KEY (post_id) REFERENCES post (id)
-);
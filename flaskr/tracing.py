@@ -0,0 +1,148 @@
+import re
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+
+from .log import init_logger
+
+
+logger = init_logger()
+
+# slow query threshold for statements run outside an app context, such as
+# while a pool warms up; the app's own is SQL_SLOW_MS
+SLOW_MS = 100
+
+
+def normalize_sql(sql):
+    """Replace literals and IN lists so similar statements read the same."""
+    sql = " ".join(sql.split())
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return re.sub(r"IN \(\?(?:, \?)*\)", "IN (...)", sql)
+
+
+class QueryTrace:
+    """Statements run while handling one request."""
+
+    def __init__(self, keep=3):
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        if len(self.slowest) < self.keep or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, sql))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[self.keep:]
+
+
+class SqlStats:
+    """Totals over every traced request of a process, for /stats/."""
+
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.duration = 0.0
+        self.slow = 0
+        self._lock = threading.Lock()
+
+    def add_request(self, trace):
+        with self._lock:
+            self.requests += 1
+            self.statements += trace.count
+            self.duration += trace.duration
+
+    def add_slow(self):
+        with self._lock:
+            self.slow += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'statements': self.statements,
+                'db_time': round(self.duration, 6),
+                'slow': self.slow,
+            }
+
+
+def get_sql_stats(app=None):
+    app = app or current_app
+    return app.extensions.setdefault('flaskr_sql_stats', SqlStats())
+
+
+def record(sql, duration):
+    if has_request_context():
+        trace = g.get('sql_trace')
+        if trace is None:
+            trace = g.sql_trace = QueryTrace()
+        trace.add(sql, duration)
+
+    slow_ms = current_app.config['SQL_SLOW_MS'] if has_app_context() else SLOW_MS
+    if duration * 1000 >= slow_ms:
+        if has_app_context():
+            get_sql_stats().add_slow()
+        logger.warning(f'Slow query ({duration * 1000:.1f} ms): {normalize_sql(sql)}')
+
+
+class TracedConnection(sqlite3.Connection):
+    """A connection that times its statements; used only when SQL_TRACE is on.
+
+    The time is that of running a statement up to its first row; rows
+    fetched later from the cursor are not included.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            record(sql, time.perf_counter() - start)
+
+    def executescript(self, sql):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql)
+        finally:
+            record(sql, time.perf_counter() - start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record('COMMIT', time.perf_counter() - start)
+
+
+def add_server_timing(response):
+    trace = g.pop('sql_trace', None)
+    if trace is None:
+        return response
+
+    get_sql_stats().add_request(trace)
+    response.headers.add(
+        'Server-Timing', f'db;dur={trace.duration * 1000:.3f};desc="{trace.count} queries"'
+    )
+    if trace.slowest:
+        slowest = '; '.join(
+            f'{duration * 1000:.1f} ms {normalize_sql(sql)}' for duration, sql in trace.slowest
+        )
+        logger.debug(f'{request.method} {request.path}: {trace.count} queries, slowest: {slowest}')
+    return response
+
+
+def init_app(app):
+    if app.config['SQL_TRACE']:
+        app.after_request(add_server_timing)
@@ -3,7 +3,8 @@ import tempfile
 import pytest
 
 from flaskr import create_app
-from flaskr.db import get_db, init_db
+from flaskr.aio import close_db_executor
+from flaskr.db import close_pool, get_db, init_db
 
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
     _data_sql = f.read().decode('utf8')
@@ -23,6 +24,11 @@ def app():
     app = create_app({
         'TESTING': True,
         'DATABASE': db_path,
+        # the parameters of the hashes in data.sql, so logins do not rehash
+        'PASSWORD_METHOD': 'pbkdf2:sha256:50000',
+        'PASSWORD_SALT_LENGTH': 8,
+        # tests/test_ratelimit.py turns limits on where it needs them
+        'RATE_LIMITS': {},
     })
 
     with app.app_context():
@@ -31,6 +37,8 @@ def app():
 
     yield app
 
+    close_db_executor(app)
+    close_pool(app)
     os.close(db_fd)
     os.unlink(db_path)
 
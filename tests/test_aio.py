@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+
+from flask import g
+
+from flaskr import create_app
+from flaskr.aio import AsgiApp, DbExecutor, close_db_executor, get_db_executor
+from flaskr.db import close_pool, get_db
+
+
+def test_executor_owns_connections(app):
+    def work():
+        return threading.current_thread().name, get_db(), g.marker
+
+    with app.test_request_context('/'):
+        g.marker = 'request'
+        name, db, marker = asyncio.run(get_db_executor(app).run(work))
+        assert name.startswith('flaskr-db')
+        assert marker == 'request'
+        assert db is not get_db()
+        assert db.execute('SELECT title FROM post WHERE id = 1').fetchone()[0] == 'test title'
+
+    stats = get_db_executor(app).stats()
+    assert stats['calls'] == 1
+    assert stats['open'] == 1
+    assert stats['running'] == 0
+
+
+def test_executor_rolls_back(app):
+    def write():
+        get_db().execute("UPDATE post SET title = 'changed'")
+        return get_db().in_transaction
+
+    with app.app_context():
+        executor = get_db_executor(app)
+        assert asyncio.run(executor.run(write))
+        assert asyncio.run(executor.run(lambda: get_db().in_transaction)) is False
+        assert get_db().execute('SELECT title FROM post WHERE id = 1').fetchone()[0] != 'changed'
+
+
+def request(asgi, method, path, body=b'', headers=(), chunk=None):
+    """Return the scope, a coroutine function running the request, and the sent messages."""
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path.partition('?')[0], 'query_string': path.partition('?')[2].encode(),
+        'root_path': '', 'server': ('localhost', 80), 'client': ('127.0.0.1', 5000),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+    }
+    chunk = chunk or max(len(body), 1)
+    incoming = [
+        {'type': 'http.request', 'body': body[i:i + chunk], 'more_body': i + chunk < len(body)}
+        for i in range(0, max(len(body), 1), chunk)
+    ]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await asgi(scope, receive, send)
+
+    return scope, run, sent
+
+
+def response(sent):
+    start = sent[0]
+    assert start['type'] == 'http.response.start'
+    assert sent[-1] == {'type': 'http.response.body', 'body': b'', 'more_body': False}
+    return start['status'], dict(start['headers']), b''.join(m['body'] for m in sent[1:])
+
+
+def test_asgi_matches_wsgi(app, client):
+    asgi = AsgiApp(app)
+    for path in ('/', '/1', '/tags', '/api/v1/posts?limit=1', '/9'):
+        _, run, sent = request(asgi, 'GET', path)
+        asyncio.run(run())
+        status, headers, body = response(sent)
+        expected = client.get(path)
+        assert status == expected.status_code
+        assert body == expected.data
+        assert headers[b'content-type'] == expected.content_type.encode()
+
+
+def test_asgi_form_post(app):
+    asgi = AsgiApp(app)
+    form = b'username=test&password=test'
+    _, run, sent = request(asgi, 'POST', '/auth/login', form, chunk=5, headers=[
+        ('Content-Type', 'application/x-www-form-urlencoded'),
+        ('Content-Length', str(len(form))),
+    ])
+    asyncio.run(run())
+    status, headers, _ = response(sent)
+    assert status == 302
+    assert headers[b'location'] == b'/'
+    cookie = headers[b'set-cookie'].split(b';')[0].decode()
+
+    _, run, sent = request(asgi, 'GET', '/', headers=[('Cookie', cookie)])
+    asyncio.run(run())
+    assert b'Log Out' in response(sent)[2]
+
+
+def test_asgi_runs_requests_concurrently(app):
+    app.config['DB_EXECUTOR_WORKERS'] = 5
+    threads = set()
+
+    @app.route('/slow')
+    def slow():
+        threads.add(threading.current_thread().name)
+        get_db().execute('SELECT 1')
+        time.sleep(0.2)
+        return 'done'
+
+    asgi = AsgiApp(app)
+    runs = [request(asgi, 'GET', '/slow') for _ in range(5)]
+    checkouts = app.extensions['flaskr_db_pool'].stats()['checkouts']
+
+    async def all_requests():
+        await asyncio.gather(*(run() for _, run, _ in runs))
+
+    start = time.perf_counter()
+    asyncio.run(all_requests())
+    assert time.perf_counter() - start < 0.6
+    assert len(threads) == 5
+    assert all(response(sent)[2] == b'done' for _, _, sent in runs)
+    # hooks and view shared the worker's own connection, none was pooled
+    assert get_db_executor(app).stats()['calls'] == 5
+    assert app.extensions['flaskr_db_pool'].stats()['checkouts'] == checkouts
+
+
+def test_asgi_errors(app):
+    app.config.update(MAX_CONTENT_LENGTH=4, PROPAGATE_EXCEPTIONS=True)
+
+    @app.route('/fail')
+    def fail():
+        raise RuntimeError('broken')
+
+    asgi = AsgiApp(app)
+    _, run, sent = request(asgi, 'POST', '/auth/login', b'0123456789')
+    asyncio.run(run())
+    assert sent[0]['status'] == 413
+
+    _, run, sent = request(asgi, 'GET', '/fail')
+    asyncio.run(run())
+    assert sent[0]['status'] == 500
+
+
+def test_asgi_traced(app):
+    traced = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'], 'SQL_TRACE': True})
+    try:
+        _, run, sent = request(AsgiApp(traced), 'GET', '/1')
+        asyncio.run(asyncio.wait_for(run(), 5))
+        status, headers, _ = response(sent)
+        assert status == 200
+        assert b'server-timing' in headers
+    finally:
+        close_db_executor(traced)
+        close_pool(traced)
+
+
+def test_asgi_worker_failure(app, monkeypatch):
+    def broken(self):
+        raise RuntimeError('no connection')
+
+    monkeypatch.setattr(DbExecutor, '_open', broken)
+    _, run, sent = request(AsgiApp(app), 'GET', '/1')
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert sent[0]['status'] == 500
+
+
+def test_asgi_lifespan(app):
+    asgi = AsgiApp(app)
+    with app.app_context():
+        get_db_executor()
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(asgi({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert 'flaskr_db_executor' not in app.extensions
@@ -0,0 +1,92 @@
+import pytest
+
+from flaskr.db import get_db
+from flaskr.post import Post
+from flaskr.routers import api
+
+
+@pytest.fixture
+def posts(app):
+    with app.app_context():
+        for i in range(6):
+            Post.create(f"post {i}", f"*body* {i}", 2, ["api", f"tag{i}"])
+        db = get_db()
+        db.executemany(
+            "INSERT INTO comment (body, author_id, post_id, created) VALUES (?, 1, 1, ?)",
+            [(f"comment {i}", f"2019-01-0{i + 1} 00:00:00") for i in range(3)],
+        )
+        db.commit()
+
+
+def test_posts_cursor_pagination(client, posts):
+    page = client.get("/api/v1/posts?limit=4").get_json()
+    assert [post["title"] for post in page["data"]] == [f"post {i}" for i in (5, 4, 3, 2)]
+    assert page["prev"] is None
+
+    page = client.get(f"/api/v1/posts?limit=4&after={page['next']}").get_json()
+    assert [post["title"] for post in page["data"]] == ["post 1", "post 0", "test title"]
+    assert page["next"] is None
+
+    page = client.get(f"/api/v1/posts?limit=4&before={page['prev']}").get_json()
+    assert len(page["data"]) == 4
+
+
+def test_fields_and_includes(client, posts):
+    post = client.get("/api/v1/posts/2?fields=id,html&include=tags,counts,author").get_json()
+    assert post["data"] == {
+        "id": 2,
+        "html": "<p><em>body</em> 0</p>",
+        "tags": ["api", "tag0"],
+        "counts": {"likes": 0, "comments": 0, "images": 0},
+        "author": {"id": 2, "username": "other", "avatar": None},
+    }
+
+    response = client.get("/api/v1/posts?fields=id,secret")
+    assert response.status_code == 400
+    assert "secret" in response.get_json()["error"]["message"]
+
+
+def test_includes_are_batched(app, client, posts):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    client.get("/api/v1/posts?limit=6&include=tags,counts,author")
+    # the page and the tags of all of its posts, however many posts
+    assert len([sql for sql in statements if not sql.startswith("--")]) <= 4
+
+
+def test_post_not_found(client):
+    response = client.get("/api/v1/posts/99")
+    assert response.status_code == 404
+    assert response.get_json()["error"]["status"] == 404
+    assert client.get("/api/v1/posts/99/comments").status_code == 404
+
+
+def test_comments(client, posts):
+    page = client.get("/api/v1/posts/1/comments?limit=2").get_json()
+    assert [c["body"] for c in page["data"]] == ["comment 2", "comment 1"]
+    assert page["data"][0]["author"] == {"id": 1, "username": "test"}
+
+    page = client.get(f"/api/v1/posts/1/comments?limit=2&after={page['next']}").get_json()
+    assert [c["body"] for c in page["data"]] == ["comment 0"]
+    assert page["next"] is None
+
+
+def test_tags_and_search(client, posts):
+    tags = client.get("/api/v1/tags").get_json()["data"]
+    assert tags[0]["name"] == "api"
+    assert tags[0]["posts"] == 6
+
+    result = client.get("/api/v1/search?q=post&limit=5&fields=id").get_json()
+    assert len(result["data"]) == 5
+    assert result["next"] == 2
+    assert "<mark>" in result["data"][0]["snippet"]
+
+
+def test_json_fallback(client, posts, monkeypatch):
+    monkeypatch.setattr(api, "orjson", None)
+    response = client.get("/api/v1/posts/2?fields=id,title")
+    assert response.get_json()["data"] == {"id": 2, "title": "post 0"}
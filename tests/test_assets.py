@@ -0,0 +1,66 @@
+import gzip
+import re
+
+import pytest
+
+from flaskr.assets import build_assets
+
+
+@pytest.fixture
+def built(app, tmp_path):
+    app.config['ASSET_FOLDER'] = str(tmp_path)
+    return build_assets(app)
+
+
+def test_asset_url_falls_back(client):
+    response = client.get('/')
+    assert b'href="/static/style.css"' in response.data
+    assert b'src="/js/like.js"' in response.data
+
+
+def test_build(runner, app, tmp_path):
+    app.config['ASSET_FOLDER'] = str(tmp_path)
+    result = runner.invoke(args=['build-assets'])
+    assert 'Built' in result.output
+
+    assert re.fullmatch(r'static/style\.[0-9a-f]{12}\.css', app.extensions['flaskr_assets']['static/style.css'])
+    assert 'js.static/like.js' in app.extensions['flaskr_assets']
+    assert (tmp_path / 'manifest.json').exists()
+
+
+def test_fingerprinted_urls(client, built):
+    response = client.get('/')
+    css = re.search(rb'href="(/assets/static/style\.\w+\.css)"', response.data).group(1)
+    assert re.search(rb'src="/assets/js/like\.\w+\.js"', response.data)
+
+    response = client.get(css.decode(), headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Type'].startswith('text/css')
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    with open('flaskr/static/style.css', 'rb') as f:
+        assert gzip.decompress(response.data) == f.read()
+
+    response = client.get(css.decode())
+    assert 'Content-Encoding' not in response.headers
+    with open('flaskr/static/style.css', 'rb') as f:
+        assert response.data == f.read()
+
+
+def test_default_avatar_fingerprinted(client, built):
+    assert 'static/images/default_ava/no_ava.jpg' in built
+    # uploads are already named by their content
+    assert not [key for key in built if re.fullmatch(r'static/images/[^/]+', key)]
+
+
+def test_brotli(client, built):
+    pytest.importorskip('brotli')
+    url = '/assets/' + built['static/style.css']
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+
+
+def test_missing_asset(client, built):
+    assert client.get('/assets/static/nope.css').status_code == 404
+    assert client.get('/assets/../secret').status_code == 404
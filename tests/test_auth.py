@@ -1,8 +1,12 @@
+import threading
+
 import pytest
 
 from flask import g, session
 
 from flaskr.db import get_db
+from flaskr.passwords import HashingBusy, get_hasher
+from flaskr.routers.auth import get_user_cache, invalidate_user
 
 
 def test_register(client, app):
@@ -66,3 +70,97 @@ def test_load_logged_in_user(client, auth):
         client.get('/')
         assert g.user is not None
         assert g.user['username'] == 'test'
+
+
+def test_load_logged_in_user_cached(app, client, auth):
+    auth.login()
+    client.get('/')
+    client.get('/')
+
+    cache = get_user_cache(app)
+    assert cache.stats()['hits'] >= 1
+    assert 'password' not in cache.get(1)
+
+    # a changed row is picked up once the entry is invalidated
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+        invalidate_user(1)
+
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'renamed'
+
+
+def test_load_logged_in_user_skipped(client, auth):
+    auth.login()
+
+    with client:
+        client.get('/rss')
+        assert g.user is None
+
+
+def test_rehash_on_login(app, auth):
+    app.config['PASSWORD_METHOD'] = 'pbkdf2:sha256:1000'
+    app.config['PASSWORD_SALT_LENGTH'] = 16
+    app.extensions.pop('flaskr_passwords', None)
+
+    with app.app_context():
+        old = get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0]
+
+    auth.login('test', 'wrong')
+    with app.app_context():
+        assert get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0] == old
+
+    assert auth.login().headers['Location'] == '/'
+    with app.app_context():
+        new = get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0]
+    assert new.startswith('pbkdf2:sha256:1000$')
+    assert len(new.split('$')[1]) == 16
+
+    # the upgraded hash still logs in and is not rehashed again
+    auth.logout()
+    assert auth.login().headers['Location'] == '/'
+    with app.app_context():
+        assert get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0] == new
+
+
+def test_hashing_cap(app, auth):
+    with app.app_context():
+        hasher = get_hasher()
+    assert hasher.executor is not None
+    # every slot taken by requests already waiting for a hash
+    while hasher.slots.acquire(blocking=False):
+        pass
+
+    assert auth.login().status_code == 503
+    hasher.slots.release()
+    assert auth.login().headers['Location'] == '/'
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'pbkdf2:sha256'])
+def test_rehash_with_default_parameters(app, method):
+    app.config['PASSWORD_METHOD'] = method
+    with app.app_context():
+        hasher = get_hasher()
+        # werkzeug stores the defaults it filled in next to the method
+        assert not hasher.needs_rehash(hasher.hash('secret'))
+        assert hasher.needs_rehash('pbkdf2:sha256:1000$abcdefgh$00')
+
+
+def test_hashing_timeout(app, auth):
+    app.config.update(PASSWORD_WORKERS=1, PASSWORD_MAX_PENDING=1, PASSWORD_TIMEOUT=0.05)
+    with app.app_context():
+        hasher = get_hasher()
+    release = threading.Event()
+
+    try:
+        with pytest.raises(HashingBusy):
+            hasher._run(release.wait)
+        # the hash still running keeps its slot after its caller gave up
+        assert auth.login().status_code == 503
+    finally:
+        release.set()
+    hasher.executor.submit(lambda: None).result()
+    assert auth.login().headers['Location'] == '/'
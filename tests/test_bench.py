@@ -0,0 +1,85 @@
+import json
+import threading
+
+from werkzeug.serving import make_server
+
+from flaskr.bench import percentile
+from flaskr.db import get_db
+
+
+def test_seed(runner, app, tmp_path):
+    app.config['IMAGE_FOLDER'] = str(tmp_path)
+    result = runner.invoke(args=['seed', '--users', '5', '--posts', '40', '--tags', '10'])
+    assert 'Added 5 users, 40 posts, 10 tags' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 41
+        assert db.execute('SELECT COUNT(*) FROM post_html').fetchone()[0] == 40
+        assert db.execute('SELECT COUNT(*) FROM post_search').fetchone()[0] == 40
+        # the triggers keep the counters of seeded rows
+        likes, comments = db.execute(
+            'SELECT SUM(likes), SUM(comments) FROM post_stats'
+        ).fetchone()
+        assert likes == db.execute('SELECT COUNT(*) FROM post_like').fetchone()[0]
+        assert comments == db.execute('SELECT COUNT(*) FROM comment').fetchone()[0]
+
+
+def test_bench(runner, tmp_path):
+    output = tmp_path / 'bench.json'
+    result = runner.invoke(args=[
+        'bench', '--sizes', '20', '--iterations', '3', '--output', str(output),
+    ])
+    assert result.exit_code == 0, result.output
+
+    results = json.loads(output.read_text())['results']
+    assert {r['scenario'] for r in results} == {
+        'index', 'post', 'tag', 'search', 'rss', 'like', 'comment',
+    }
+    assert all(r['p95_ms'] >= r['p50_ms'] > 0 and r['queries'] > 0 for r in results)
+
+    result = runner.invoke(args=[
+        'bench', '--sizes', '20', '--iterations', '3', '--compare', str(output),
+    ])
+    assert '%' in result.output
+
+
+def test_percentile():
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile([3, 1, 2, 4], 95) == 4
+    assert percentile([5], 95) == 5
+
+
+def test_bench_login(runner, app, tmp_path):
+    app.config['PASSWORD_METHOD'] = 'pbkdf2:sha256:1000'
+    output = tmp_path / 'login.json'
+    result = runner.invoke(args=[
+        'bench-login', '--duration', '0.3', '--login-threads', '1', '--read-threads', '1',
+        '--output', str(output),
+    ])
+    assert result.exit_code == 0, result.output
+
+    results = json.loads(output.read_text())['results']
+    assert [r['mode'] for r in results] == ['inline', 'capped']
+    assert all(r['logins_per_s'] > 0 and r['reads_per_s'] > 0 for r in results)
+
+
+def test_bench_server(app, runner, tmp_path):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    output = tmp_path / 'server.json'
+    try:
+        result = runner.invoke(args=[
+            'bench-server', '--url', f'dev=http://127.0.0.1:{server.port}',
+            '--path', '/', '--path', '/tags', '--duration', '0.6',
+            '--connections', '2', '--slow-clients', '1', '--output', str(output),
+        ])
+    finally:
+        server.shutdown()
+        thread.join()
+    assert result.exit_code == 0, result.output
+
+    results = json.loads(output.read_text())['results']
+    assert [r['server'] for r in results] == ['dev']
+    assert results[0]['reads_per_s'] > 0 and results[0]['errors'] == 0
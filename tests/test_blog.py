@@ -1,6 +1,10 @@
+import re
+
 import pytest
 
-from flaskr.db import get_db
+from flaskr import create_app
+from flaskr.db import close_pool, get_db, init_db, upgrade_db
+from flaskr.markdown import EXCERPT_CHARS, excerpt, render
 from flaskr.routers.blog import Post, validate_post
 
 
@@ -184,8 +188,325 @@ def test_rss(client):
     assert b'<?xml version="1.0" encoding="UTF-8"?>' in response.data
 
 
+def test_rss_limit_and_conditional(app, client, auth):
+    app.config['RSS_ITEMS'] = 2
+    auth.login()
+    for i in range(3):
+        client.post('/create', data={'title': f'feed {i}', 'body': 'b', 'tags': ['one']})
+
+    response = client.get('/rss')
+    assert response.data.count(b'<item>') == 2
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    unchanged = client.get('/rss', headers={'If-None-Match': response.headers['ETag']})
+    assert unchanged.status_code == 304
+
+    client.post('/1/update', data={'title': 'renamed', 'body': 'b', 'tags': 'one'})
+    changed = client.get('/rss', headers={'If-None-Match': response.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != response.headers['ETag']
+
+
+def test_rss_per_app(app, client, tmp_path):
+    other = create_app({
+        'TESTING': True, 'DATABASE': str(tmp_path / 'other.sqlite'), 'RATE_LIMITS': {},
+    })
+    with other.app_context():
+        init_db()
+        get_db().execute("INSERT INTO user (username, password) VALUES ('o', 'x')")
+        get_db().execute("INSERT INTO post (title, body, author_id) VALUES ('elsewhere', 'b', 1)")
+        get_db().commit()
+
+    # both databases are at the same posts generation
+    assert b'test title' in client.get('/rss').data
+    feed = other.test_client().get('/rss').data
+    assert b'elsewhere' in feed
+    assert b'test title' not in feed
+    close_pool(other)
+
+
+def test_rss_archive(app, client):
+    assert client.get('/rss/archive').status_code == 404
+
+    app.config['RSS_ARCHIVE'] = True
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id) VALUES (?, 'b', 1)",
+            [(f'old {i}',) for i in range(250)],
+        )
+        db.commit()
+
+    response = client.get('/rss/archive')
+    assert response.is_streamed
+    assert response.content_type == 'application/rss+xml'
+    assert response.data.count(b'<item>') == 251
+
+
 def test_validate_post():
     assert validate_post("Title", "Body") is None
     assert validate_post("", "Body") == "Title is required"
     assert validate_post("Title", "") == "Body is required"
     assert validate_post("", "") == "Title is required"
+
+
+def test_index_query_count(app, client, auth):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    def count_selects(path):
+        client.get(path)
+        statements.clear()
+        response = client.get(path)
+        assert response.status_code == 200
+        return len([s for s in statements if s.lstrip().upper().startswith('SELECT')])
+
+    auth.login()
+    single = count_selects('/')
+
+    for i in range(5):
+        client.post('/create', data={'title': f'post {i}', 'body': 'body', 'tags': [f'tag{i}, common']})
+
+    response = client.get('/')
+    assert b'tag4' in response.data and b'common' in response.data
+    # tags for the whole page come from one query, not one per post
+    assert count_selects('/') == single
+    assert count_selects('/tag/common') <= single
+
+
+def test_index_cursor_pagination(app, client):
+    app.config['POSTS_PER_PAGE'] = 3
+    with app.app_context():
+        db = get_db()
+        # several posts share a timestamp, so ordering falls back to the id
+        db.executemany(
+            "INSERT INTO post (title, body, author_id, created) VALUES (?, 'b', 1, ?)",
+            [(f'post {i}', f'2020-01-0{1 + i // 2} 00:00:00') for i in range(7)],
+        )
+        db.commit()
+
+    def titles(response):
+        return re.findall(rb'<a href="/\d+">([^<]+)</a>', response.data)
+
+    def link(response, label):
+        match = re.search(rb'<a href="([^"]+)">' + label + rb'</a>', response.data)
+        return match and match.group(1).decode().replace('&amp;', '&')
+
+    seen, pages = [], []
+    response = client.get('/')
+    assert link(response, b'Previous') is None
+    while True:
+        seen += titles(response)
+        pages.append(response)
+        next_url = link(response, b'Next')
+        if next_url is None:
+            break
+        response = client.get(next_url)
+
+    expected = [f'post {i}'.encode() for i in reversed(range(7))] + [b'test title']
+    assert seen == expected
+
+    previous = client.get(link(pages[-1], b'Previous'))
+    assert titles(previous) == titles(pages[-2])
+
+    # old links keep working for the first pages only
+    assert titles(client.get('/?page=2')) == titles(pages[1])
+    assert client.get('/?page=50').status_code == 302
+    assert client.get('/?after=%%%').status_code == 400
+
+
+def test_search_full_text(client, auth, app):
+    auth.login()
+    client.post('/create', data={'title': 'Gardening notes', 'body': 'Soil <b>and</b> compost', 'tags': ['garden']})
+    client.post('/create', data={'title': 'Kitchen', 'body': 'Compost scraps from the kitchen', 'tags': ['food']})
+
+    response = client.get('/search?q=compost')
+    assert response.status_code == 200
+    assert b'<mark>compost</mark>' in response.data.lower()
+    # post bodies are escaped inside snippets
+    assert b'&lt;b&gt;' in response.data
+
+    # tags are indexed and a title hit ranks first
+    response = client.get('/search?q=garden')
+    assert re.findall(rb'<a href="/\d+">([^<]+)</a>', response.data) == [b'Gardening notes']
+
+    with app.app_context():
+        post_id = get_db().execute("SELECT id FROM post WHERE title = 'Kitchen'").fetchone()[0]
+    client.post(f'/{post_id}/delete')
+    assert b'Kitchen' not in client.get('/search?q=kitchen').data
+
+
+def test_rebuild_search_index_command(runner, client, app):
+    with app.app_context():
+        db = get_db()
+        # a database from before the index existed is indexed when migrated
+        db.execute('DROP TABLE post_search')
+        db.commit()
+        db.execute('PRAGMA user_version = 0')
+        upgrade_db()
+    assert b'test title' in client.get('/search?q=body').data
+
+    with app.app_context():
+        get_db().execute('DELETE FROM post_search')
+        get_db().commit()
+    assert b'test title' not in client.get('/search?q=body').data
+
+    result = runner.invoke(args=['rebuild-search-index'])
+    assert 'Indexed 1 posts' in result.output
+    assert b'test title' in client.get('/search?q=body').data
+
+
+def test_like_json_toggle(client, auth, app):
+    auth.login()
+    headers = {'Accept': 'application/json'}
+
+    response = client.post('/1/like', headers=headers)
+    assert response.json == {'liked': True, 'likes': 1}
+    assert client.post('/1/like', headers=headers).json == {'liked': False, 'likes': 0}
+    assert client.post('/1/like', headers=headers).json == {'liked': True, 'likes': 1}
+
+    with app.app_context():
+        rows = get_db().execute('SELECT COUNT(*) FROM post_like').fetchone()[0]
+        assert rows == 1
+
+    assert client.post('/99/like', headers=headers).status_code == 404
+
+
+def test_like_script_served(client):
+    response = client.get('/')
+    assert b'src="/js/like.js"' in response.data
+    assert client.get('/js/like.js').status_code == 200
+
+
+def test_tag_pagination(app, client, auth):
+    app.config['POSTS_PER_PAGE'] = 2
+    auth.login()
+    for i in range(5):
+        client.post('/create', data={'title': f'tagged {i}', 'body': 'b', 'tags': ['paged']})
+
+    titles = []
+    url = '/tag/paged'
+    while url:
+        response = client.get(url)
+        titles += re.findall(rb'<a href="/\d+">([^<]+)</a>', response.data)
+        match = re.search(rb'<a href="([^"]+)">Next</a>', response.data)
+        url = match and match.group(1).decode().replace('&amp;', '&')
+
+    assert titles == [f'tagged {i}'.encode() for i in reversed(range(5))]
+
+
+def test_tag_cloud(app, client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'a', 'body': 'b', 'tags': ['popular, rare']})
+    client.post('/create', data={'title': 'b', 'body': 'b', 'tags': ['popular']})
+
+    response = client.get('/tags', headers={'Accept': 'application/json'})
+    assert response.json == [{'name': 'popular', 'posts': 2}, {'name': 'rare', 'posts': 1}]
+    assert b'href="/tag/rare"' in client.get('/tags').data
+
+    # a tag disappears with the last post using it
+    client.post('/2/update', data={'title': 'a', 'body': 'b', 'tags': 'popular'})
+    assert [t['name'] for t in client.get('/tags', headers={'Accept': 'application/json'}).json] == ['popular']
+    client.post('/2/delete')
+    client.post('/3/delete')
+    assert client.get('/tags', headers={'Accept': 'application/json'}).json == []
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM tags').fetchone()[0] == 0
+        assert db.execute('SELECT COUNT(*) FROM tag_stats').fetchone()[0] == 0
+
+
+def test_comment_missing_post(client, auth):
+    auth.login()
+    assert client.post('/9/comment', data={'body': 'lost'}).status_code == 404
+
+
+def test_comment_pages(app, client, auth):
+    app.config['COMMENTS_PER_PAGE'] = 2
+    auth.login()
+    for i in range(5):
+        client.post('/1/comment', data={'body': f'note {i}'})
+    auth.logout()
+
+    response = client.get('/1')
+    assert b'Comments (5)' in response.data
+    assert re.findall(rb'Comment (note \d)', response.data) == [b'note 4', b'note 3']
+
+    bodies = []
+    url = re.search(rb'data-fragment="([^"]+)"', response.data).group(1).decode()
+    while url:
+        response = client.get(url.replace('&amp;', '&'))
+        bodies += re.findall(rb'Comment (note \d)', response.data)
+        match = re.search(rb'data-fragment="([^"]+)"', response.data)
+        url = match and match.group(1).decode()
+    assert bodies == [b'note 2', b'note 1', b'note 0']
+
+    # without JavaScript the link opens the post at the next page
+    link = re.search(rb'href="(/1\?comments_after=[^"]+)"', client.get('/1').data).group(1)
+    response = client.get(link.decode().replace('&amp;', '&'))
+    assert re.findall(rb'Comment (note \d)', response.data) == [b'note 2', b'note 1']
+
+
+def test_listings_stream(client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'streamed', 'body': 'b', 'tags': ['flow']})
+
+    response = client.get('/tag/flow')
+    assert response.is_streamed
+    assert b'streamed' in response.data
+
+    response = client.get('/search?q=streamed')
+    assert response.is_streamed
+    assert b'<mark>streamed</mark>' in response.data
+    assert b'Nothing found' in client.get('/search?q=absent').data
+
+
+def test_excerpts(app, client, auth):
+    auth.login()
+    body = '\n\n'.join(f'Paragraph {i}' for i in range(6))
+    client.post('/create', data={'title': 'long', 'body': body, 'tags': ['']})
+
+    response = client.get('/')
+    assert b'<p>Paragraph 2</p>' in response.data
+    assert b'Paragraph 3' not in response.data
+    assert response.data.count(b'class="read-more"') == 1
+    assert b'data-body="/2/body"' in response.data
+
+    response = client.get('/2/body')
+    assert response.data.decode() == '\n'.join(f'<p>Paragraph {i}</p>' for i in range(6))
+    assert client.get('/9/body').status_code == 404
+
+    with app.app_context():
+        row = get_db().execute('SELECT * FROM post_excerpt WHERE post_id = 2').fetchone()
+        assert row['truncated']
+        # excerpts of posts stored before they existed are filled in lazily
+        get_db().execute('DELETE FROM post_excerpt')
+        get_db().commit()
+
+    assert b'<p>Paragraph 2</p>' in client.get('/?page=1').data
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM post_excerpt').fetchone()[0] == 2
+
+
+def test_excerpt_limits():
+    # line separators other than "\n" must not shift the block offsets
+    html = render('one\u2028two\n\n```\ncode\x0cmore\n```\n\nthree\n\nfour')
+    cut, truncated = excerpt(html)
+    assert cut.endswith('<p>three</p>') and truncated
+    assert cut.count('<pre>') == cut.count('</pre>') == 1
+
+    # a first block longer than EXCERPT_CHARS is cut as text
+    cut, truncated = excerpt(render('word ' * 500))
+    assert truncated
+    assert len(cut) <= EXCERPT_CHARS + 10
+    assert cut.startswith('<p>word') and cut.endswith('\u2026</p>')
+
+    # later blocks that do not fit are left out
+    cut, truncated = excerpt(render('short\n\n' + 'word ' * 500))
+    assert (cut, truncated) == ('<p>short</p>', True)
+    assert excerpt(render('short')) == ('<p>short</p>', False)
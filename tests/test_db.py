@@ -1,11 +1,33 @@
 import sqlite3
+import threading
 
 import pytest
 
-from flaskr.db import get_db
+from flaskr import create_app
+from flaskr.db import (
+    PoolTimeout, check_db, close_pool, get_db, get_migrations, get_pool,
+    schema_version, upgrade_db
+)
 
 
 def test_get_close_db(app):
+    with app.app_context():
+        db = get_db()
+        assert db is get_db()
+
+    # the connection went back to the pool and is reused
+    with app.app_context():
+        assert get_db() is db
+        db.execute('SELECT 1')
+
+
+def test_get_close_db_without_pool(app):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'DB_POOL_SIZE': 0,
+    })
+
     with app.app_context():
         db = get_db()
         assert db is get_db()
@@ -14,6 +36,60 @@ def test_get_close_db(app):
         db.execute('SELECT 1')
 
     assert 'closed' in str(e.value)
+    close_pool(app)
+
+
+def test_pool_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_pool_wait_and_timeout(app):
+    pool = get_pool(app)
+    pool.size, pool.timeout = 1, 0.05
+
+    db = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    timer = threading.Timer(0.01, pool.release, (db,))
+    timer.start()
+    pool.timeout = 5
+    assert pool.acquire() is db
+    timer.join()
+    pool.release(db)
+
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['waits'] == 1
+    assert stats['in_use'] == 0
+
+
+def test_pool_timeout_is_503(app, client):
+    pool = get_pool(app)
+    pool.size, pool.timeout = 1, 0.05
+    db = pool.acquire()
+    try:
+        response = client.get('/')
+    finally:
+        pool.release(db)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.get('/').status_code == 200
+
+
+def test_stats_endpoint(app):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'STATS_ENDPOINT': True,
+    })
+    response = app.test_client().get('/stats/')
+    assert response.json['db_pool']['size'] == 5
+    close_pool(app)
 
 
 def test_init_db_command(runner, monkeypatch):
@@ -27,3 +103,34 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
     assert Recorder.called
+
+
+def test_upgrade_db(app):
+    with app.app_context():
+        db = get_db()
+        latest = get_migrations()[-1][0]
+        assert schema_version(db) == latest
+        # nothing left to apply on an up to date database
+        assert upgrade_db() == []
+
+        db.execute('PRAGMA user_version = 0')
+        assert upgrade_db()[0] == '0001_initial.sql'
+        assert schema_version(db) == latest
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
+
+
+def test_db_upgrade_command(runner):
+    result = runner.invoke(args=['db-upgrade'])
+    assert 'Database is at version' in result.output
+    assert 'Applied' not in result.output
+
+
+def test_check_db_without_auto_upgrade(app, caplog):
+    with app.app_context():
+        get_db().execute('PRAGMA user_version = 0')
+
+    app.config['DB_AUTO_UPGRADE'] = False
+    with app.app_context():
+        check_db()
+        assert schema_version(get_db()) == 0
+    assert 'flask db-upgrade' in caplog.text
@@ -0,0 +1,86 @@
+import io
+import os
+
+from PIL import Image
+
+from flaskr.db import get_db, get_generations
+from flaskr.images import get_pipeline
+
+
+def make_png(width=1000, height=500, color='red'):
+    data = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(data, 'PNG')
+    data.seek(0)
+    return data
+
+
+def create_post(client, image, filename='photo.png'):
+    return client.post('/create', data={
+        'title': 'with image', 'body': 'b', 'tags': ['one'],
+        'image': (image, filename),
+    }, content_type='multipart/form-data')
+
+
+def test_upload_makes_variants(app, client, auth, tmp_path):
+    app.config.update(IMAGE_FOLDER=str(tmp_path), IMAGE_WORKERS=0)
+    auth.login()
+    create_post(client, make_png())
+
+    with app.app_context():
+        db = get_db()
+        image = db.execute('SELECT * FROM image').fetchone()
+        variants = db.execute(
+            'SELECT width, format FROM image_variant WHERE image_id = ? ORDER BY width, format',
+            (image['id'],),
+        ).fetchall()
+
+    filename = os.path.basename(image['image_path'])
+    assert filename != 'photo.png' and filename.endswith('.png')
+    assert [tuple(v) for v in variants] == [
+        (320, 'png'), (320, 'webp'), (640, 'png'), (640, 'webp'), (1000, 'png'), (1000, 'webp'),
+    ]
+    assert len(os.listdir(tmp_path)) == 6
+    with Image.open(tmp_path / filename.replace('.png', '-320.webp')) as small:
+        assert small.size == (320, 160)
+
+    response = client.get(f"/{image['post_id']}")
+    assert b'type="image/webp"' in response.data
+    assert b'-640.webp 640w' in response.data
+
+
+def test_upload_dedupes_by_content(app, client, auth, tmp_path):
+    app.config.update(IMAGE_FOLDER=str(tmp_path), IMAGE_WORKERS=0, IMAGE_WIDTHS=())
+    auth.login()
+    create_post(client, make_png(color='blue'), 'a.png')
+    create_post(client, make_png(color='blue'), 'b.png')
+
+    with app.app_context():
+        paths = get_db().execute('SELECT image_path FROM image').fetchall()
+    assert len(paths) == 2 and paths[0][0] == paths[1][0]
+
+
+def test_upload_in_background(app, client, auth, tmp_path):
+    app.config.update(IMAGE_FOLDER=str(tmp_path), IMAGE_WORKERS=1)
+    auth.login()
+    create_post(client, make_png())
+    get_pipeline(app).executor.shutdown(wait=True)
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM image_variant').fetchone()[0] == 6
+        # cached pages of the post are renewed once its variants exist
+        assert get_generations(('post:2',)) == (1,)
+
+
+def test_regenerate_images_command(app, runner, tmp_path):
+    app.config.update(IMAGE_FOLDER=str(tmp_path))
+    Image.open(make_png()).save(tmp_path / 'old.png')
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO image (post_id, image_path) VALUES (1, '/static/images/old.png')")
+        db.execute("INSERT INTO image (post_id, image_path) VALUES (1, '/static/images/gone.png')")
+        db.commit()
+
+    result = runner.invoke(args=['regenerate-images'])
+    assert 'Missing file gone.png' in result.output
+    assert 'Processed 1 of 2 images' in result.output
+    assert (tmp_path / 'old-640.webp').exists()
@@ -1,7 +1,8 @@
 from datetime import datetime
 
-from flaskr.db import get_db
-from flaskr.post import Post
+from flaskr.db import get_db, upgrade_db
+from flaskr.markdown import content_hash, html_cache
+from flaskr.post import POSTS_SELECT, Post, PostStream, encode_cursor, normalize_tags
 
 
 def test_post_create(client, auth, app):
@@ -34,3 +35,154 @@ def test_post_tags(auth, app):
     with app.app_context():
         post = Post(1, 'test', 'test', datetime.now(), 1, 'testuser', 0, 0, None, None)
         assert post.tags == []
+
+
+def test_post_create_stores_html(client, auth, app):
+    auth.login()
+    client.post('/create', data={'title': 'md', 'body': '# heading', 'tags': ['one']})
+
+    with app.app_context():
+        row = get_db().execute(
+            'SELECT h.html FROM post_html h JOIN post p ON p.id = h.post_id '
+            "WHERE p.title = 'md'"
+        ).fetchone()
+        assert row['html'] == '<h1>heading</h1>'
+
+
+def test_post_body_html_backfill(app):
+    html_cache.clear()
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM post_html').fetchone()[0] == 0
+
+        post = Post.get_posts(1, 5)[0]
+        assert post.html is None
+        assert '<p>test\nbody</p>' == post.body_html
+
+        row = db.execute('SELECT * FROM post_html WHERE post_id = 1').fetchone()
+        assert row['body_hash'] == content_hash('test\nbody')
+        # listings carry the stored excerpt instead of the full HTML
+        assert Post.get_posts(1, 5)[0].excerpt == row['html']
+
+
+def test_render_posts_command(runner, app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post_html VALUES (1, 'stale', 'stale')")
+        db.commit()
+
+    result = runner.invoke(args=['render-posts'])
+    assert 'Rendered 1 posts' in result.output
+
+    with app.app_context():
+        row = get_db().execute('SELECT * FROM post_html WHERE post_id = 1').fetchone()
+        assert row['body_hash'] == content_hash('test\nbody')
+
+
+def test_post_stats_triggers(client, auth, app):
+    auth.login()
+    client.post('/1/like')
+    client.post('/1/comment', data={'body': 'first'})
+    client.post('/1/comment', data={'body': 'second'})
+
+    with app.app_context():
+        db = get_db()
+        stats = db.execute('SELECT * FROM post_stats WHERE post_id = 1').fetchone()
+        assert (stats['likes'], stats['comments'], stats['images']) == (1, 2, 0)
+
+        post = Post.get_post(1)['post']
+        assert (post.likes, post.comments) == (1, 2)
+
+    client.post('/1/like')
+
+    with app.app_context():
+        assert Post.get_posts(1, 5)[0].likes == 0
+
+
+def test_stats_backfilled_on_upgrade(client, auth, app):
+    with app.app_context():
+        db = get_db()
+        db.execute('INSERT INTO post_like (user_id, post_id, liked) VALUES (1, 1, TRUE), (2, 1, TRUE)')
+        db.execute("INSERT INTO comment (author_id, post_id, body) VALUES (2, 1, 'c')")
+        # a database from before post_stats existed
+        db.execute('DROP TABLE post_stats')
+        db.commit()
+        db.execute('PRAGMA user_version = 0')
+        upgrade_db()
+
+        post = Post.get_post(1)['post']
+        assert (post.likes, post.comments) == (2, 1)
+
+    auth.login()
+    response = client.post('/1/like', headers={'Accept': 'application/json'})
+    assert response.json == {'liked': False, 'likes': 1}
+
+
+def test_reconcile_counters_command(runner, app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO comment (author_id, post_id, body) VALUES (1, 1, 'c')")
+        db.execute('UPDATE post_stats SET likes = 7, comments = 0 WHERE post_id = 1')
+        db.commit()
+
+    result = runner.invoke(args=['reconcile-counters'])
+    assert 'Reconciled 1 posts, fixed 1' in result.output
+
+    with app.app_context():
+        stats = get_db().execute('SELECT * FROM post_stats WHERE post_id = 1').fetchone()
+        assert (stats['likes'], stats['comments']) == (0, 1)
+
+
+def test_normalize_tags():
+    assert normalize_tags(['a, b,,  a , c  d']) == ['a', 'b', 'c d']
+    assert normalize_tags('one') == ['one']
+    assert normalize_tags(['']) == []
+    assert normalize_tags(None) == []
+
+
+def test_post_create_update_single_transaction(app):
+    statements = []
+    with app.test_request_context():
+        db = get_db()
+        db.set_trace_callback(statements.append)
+
+        post_id = Post.create('t', 'b', 1, ['one, two, one'])
+        assert statements.count('COMMIT') == 1
+        assert Post.get_post(post_id)['tags'] == ['one', 'two']
+
+        statements.clear()
+        Post.update(post_id, 't', 'b', 'two, three')
+        assert statements.count('COMMIT') == 1
+        assert Post.get_post(post_id)['tags'] == ['two', 'three']
+
+
+def test_update_does_not_create_letter_tags(client, auth, app):
+    auth.login()
+    client.post('/1/update', data={'title': 't', 'body': 'b', 'tags': 'alpha, beta'})
+
+    with app.app_context():
+        names = [row[0] for row in get_db().execute('SELECT name_tag FROM tags')]
+        assert sorted(names) == ['alpha', 'beta']
+
+
+def test_post_stream(app):
+    with app.app_context():
+        for i in range(6):
+            Post.create(f'post {i}', 'body', 1, [f'tag{i}'])
+
+        statements = []
+        db = get_db()
+        db.set_trace_callback(statements.append)
+        stream = PostStream(
+            db.execute(POSTS_SELECT + 'ORDER BY p.id DESC LIMIT 6'), limit=5, size=2
+        )
+        assert statements[-1].startswith('SELECT p.id')
+
+        posts = list(stream)
+        assert [post.title for post in posts] == [f'post {i}' for i in range(5, 0, -1)]
+        assert [post.tags for post in posts[:2]] == [['tag5'], ['tag4']]
+        # one tag query per chunk of rows, none per post
+        assert len([sql for sql in statements if 'name_tag' in sql]) == 3
+        assert stream.has_more
+        assert stream.next_cursor == encode_cursor(posts[-1])
+        assert stream.prev_cursor is None
@@ -0,0 +1,103 @@
+import io
+import re
+
+import pytest
+from PIL import Image
+
+from flaskr.db import get_db, get_pool
+
+
+HOT_TABLES = (
+    'user', 'post', 'post_like', 'comment', 'post_tag', 'tags', 'image',
+    'image_variant', 'post_html', 'post_excerpt', 'post_stats', 'generation',
+)
+
+
+@pytest.fixture
+def statements(app, monkeypatch):
+    """Record every statement run on any pooled connection."""
+    statements = []
+    pool = get_pool(app)
+    pool.dispose()
+    connect = pool.connect
+
+    def traced_connect():
+        db = connect()
+        db.set_trace_callback(statements.append)
+        return db
+
+    monkeypatch.setattr(pool, 'connect', traced_connect)
+    return statements
+
+
+def seed(client, auth):
+    auth.login()
+    for i in range(8):
+        image = io.BytesIO()
+        Image.new('RGB', (400, 200), (i * 30, 0, 0)).save(image, 'PNG')
+        image.seek(0)
+        client.post('/create', data={
+            'title': f'post {i}', 'body': f'body {i} with *markdown*',
+            'tags': [f'tag{i % 3}, common'], 'image': (image, 'photo.png'),
+        }, content_type='multipart/form-data')
+    for post_id in range(1, 6):
+        client.post(f'/{post_id}/like')
+        client.post(f'/{post_id}/comment', data={'body': f'comment on {post_id}'})
+
+
+def exercise(app, client, auth):
+    auth.login()
+    response = client.get('/')
+    next_url = re.search(rb'<a href="([^"]+)">Next</a>', response.data).group(1)
+    client.get(next_url.decode().replace('&amp;', '&'))
+    client.get('/?page=2')
+    client.get('/3')
+    client.get('/3/comments')
+    client.get('/tag/common')
+    client.get('/tags')
+    client.get('/search?q=markdown')
+    client.get('/rss')
+    app.config['RSS_ARCHIVE'] = True
+    client.get('/rss/archive')
+    client.post('/3/like')
+    client.post('/3/comment', data={'body': 'another'})
+    client.post('/3/update', data={'title': 'updated', 'body': 'updated', 'tags': 'tag1, new'})
+    client.post('/4/delete')
+    auth.logout()
+    auth.login('other', 'other')
+    client.post('/auth/register', data={'username': 'new', 'password': 'new'})
+
+
+def plan_problems(db, statement):
+    """Return the plan steps of a statement that read a whole hot table."""
+    if not re.match(r'\s*(SELECT|UPDATE|DELETE|INSERT|WITH)\b', statement, re.I):
+        return []
+    problems = []
+    for row in db.execute('EXPLAIN QUERY PLAN ' + statement).fetchall():
+        detail = row['detail']
+        # "SCAN post AS p" since SQLite 3.36, "SCAN TABLE post AS p" before
+        scan = re.fullmatch(r'SCAN (TABLE )?\w+( AS \w+)?', detail)
+        if scan or 'AUTOMATIC' in detail:
+            problems.append(detail)
+    return problems
+
+
+def test_hot_queries_use_indexes(app, client, auth, statements, tmp_path):
+    app.config.update(IMAGE_FOLDER=str(tmp_path), IMAGE_WORKERS=0)
+    seed(client, auth)
+    statements.clear()
+    exercise(app, client, auth)
+
+    assert len(statements) > 50
+    failures = {}
+    with app.app_context():
+        db = get_db()
+        tables = {t: re.compile(rf'\b{t}\b') for t in HOT_TABLES}
+        for statement in dict.fromkeys(statements):
+            if not any(t.search(statement) for t in tables.values()):
+                continue
+            problems = plan_problems(db, statement)
+            if problems:
+                failures[statement] = problems
+
+    assert failures == {}
@@ -0,0 +1,99 @@
+import multiprocessing
+
+import pytest
+
+from flaskr import create_app
+from flaskr.ratelimit import RateLimiter, get_limiter
+
+
+@pytest.fixture
+def limited(app, tmp_path):
+    app.config['RATE_LIMIT_DATABASE'] = str(tmp_path / 'ratelimit.sqlite')
+    app.config['RATE_LIMITS'] = {
+        'auth.login': (2, 60, ('POST',)),
+        'blog.search': (3, 60),
+        'api.search': (1, 60),
+    }
+    return app
+
+
+def test_bucket_refills():
+    limiter = RateLimiter(':memory:')
+    assert limiter.hit('a', 2, 10, now=100) == 0
+    assert limiter.hit('a', 2, 10, now=100) == 0
+    assert limiter.hit('a', 2, 10, now=100) == pytest.approx(5)
+    # half a token after 2.5 seconds, one after 5
+    assert limiter.hit('a', 2, 10, now=102.5) == pytest.approx(2.5)
+    assert limiter.hit('a', 2, 10, now=105) == 0
+    # other keys have their own bucket
+    assert limiter.hit('b', 2, 10, now=105) == 0
+
+
+def test_rejects_with_retry_after(limited, client):
+    for _ in range(3):
+        assert client.get('/search?q=test').status_code == 200
+
+    response = client.get('/search?q=test')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '20'
+    assert get_limiter(limited).stats() == {'blog.search': 1}
+
+
+def test_api_rejects_with_retry_after(limited, client):
+    assert client.get('/api/v1/search?q=test').status_code == 200
+
+    response = client.get('/api/v1/search?q=test')
+    assert response.status_code == 429
+    assert response.json['error']['status'] == 429
+    assert response.headers['Retry-After'] == '60'
+
+
+def test_counts_only_listed_methods(limited, client, auth):
+    for _ in range(5):
+        assert client.get('/auth/login').status_code == 200
+    assert auth.login(password='a').status_code == 200
+    assert auth.login(password='b').status_code == 200
+    assert auth.login().status_code == 429
+
+
+def test_keyed_by_user(limited, client, auth):
+    for _ in range(3):
+        client.get('/search?q=test')
+    assert client.get('/search?q=test').status_code == 429
+
+    # logging in moves the client to a bucket of its own
+    assert auth.login().status_code == 302
+    assert client.get('/search?q=test').status_code == 200
+
+
+def _take(path, results):
+    results.put(RateLimiter(path).hit('shared', 5, 3600))
+
+
+def test_shared_across_processes(tmp_path):
+    path = str(tmp_path / 'ratelimit.sqlite')
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_take, args=(path, results)) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    waits = sorted(results.get() for _ in workers)
+    assert waits[:5] == [0] * 5
+    assert all(wait > 0 for wait in waits[5:])
+
+
+def test_idle_buckets_pruned():
+    limiter = RateLimiter(':memory:')
+    limiter.hit('old', 2, 10, now=100)
+    limiter.hit('new', 2, 10, now=105)
+    assert limiter.prune(10, now=112) == 1
+    assert limiter.connect().execute('SELECT key FROM bucket').fetchall() == [('new',)]
+
+
+def test_search_limited_by_default(app):
+    limits = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE']}).config['RATE_LIMITS']
+    # the API runs the same full-text search as the page
+    assert limits['api.search'] == limits['blog.search']
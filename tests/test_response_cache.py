@@ -0,0 +1,121 @@
+import pytest
+
+from flaskr.db import get_generations
+from flaskr.response_cache import DiskBackend, get_response_cache
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def cache_app(request, app, tmp_path):
+    app.config.update(RESPONSE_CACHE=request.param, RESPONSE_CACHE_DIR=str(tmp_path))
+    return app
+
+
+def test_anonymous_pages_cached(cache_app, client):
+    first = client.get('/1')
+    second = client.get('/1')
+    assert first.data == second.data
+    assert first.headers['ETag'] == second.headers['ETag']
+
+    stats = get_response_cache(cache_app).stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+    response = client.get('/1', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_writes_invalidate(cache_app, client, auth):
+    assert b'Like (0)' in client.get('/').data
+    assert b'Like (0)' in client.get('/1').data
+
+    auth.login()
+    client.post('/1/like')
+    auth.logout()
+
+    assert b'Like (1)' in client.get('/').data
+    assert b'Like (1)' in client.get('/1').data
+
+
+def test_delete_invalidates(cache_app, client, auth):
+    assert client.get('/1').status_code == 200
+
+    auth.login()
+    assert client.get('/1/delete').status_code == 405
+    client.post('/1/delete')
+    auth.logout()
+
+    assert client.get('/1').status_code == 404
+
+
+def test_commands_invalidate(cache_app, client, runner):
+    client.get('/1')
+    with cache_app.app_context():
+        before = get_generations(('posts', 'post:1'))
+
+    runner.invoke(args=['render-posts'])
+
+    with cache_app.app_context():
+        after = get_generations(('posts', 'post:1'))
+    assert all(new > old for new, old in zip(after, before))
+    client.get('/1')
+    assert get_response_cache(cache_app).stats()['hits'] == 0
+
+
+def test_other_posts_stay_cached(cache_app, client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'second', 'body': 'b', 'tags': ['one']})
+    auth.logout()
+
+    client.get('/2')
+    auth.login()
+    client.post('/1/comment', data={'body': 'hello'})
+    auth.logout()
+    client.get('/2')
+
+    assert get_response_cache(cache_app).stats()['hits'] == 1
+
+
+def test_negotiated_pages(cache_app, client):
+    json = client.get('/tags', headers={'Accept': 'application/json'})
+    assert json.content_type == 'application/json'
+    html = client.get('/tags')
+    assert html.content_type.startswith('text/html')
+    assert client.get('/tags', headers={'Accept': 'application/json'}).data == json.data
+    assert set(html.vary) == {'Accept', 'Cookie'}
+    assert get_response_cache(cache_app).stats()['hits'] == 1
+
+
+def test_logged_in_not_cached(cache_app, client, auth):
+    auth.login()
+    client.get('/')
+    client.get('/')
+    stats = get_response_cache(cache_app).stats()
+    assert (stats['hits'], stats['misses']) == (0, 0)
+
+
+def test_cache_disabled(app, client):
+    app.config['RESPONSE_CACHE'] = None
+    assert client.get('/').status_code == 200
+    assert get_response_cache(app) is None
+
+
+def test_streamed_pages_cached(cache_app, client):
+    first = client.get('/tag/none')
+    assert first.is_streamed
+    assert 'ETag' not in first.headers
+    first.get_data()
+
+    second = client.get('/tag/none')
+    assert second.data == first.data
+    assert get_response_cache(cache_app).stats()['hits'] == 1
+    assert client.get(
+        '/tag/none', headers={'If-None-Match': second.headers['ETag']}
+    ).status_code == 304
+
+
+def test_disk_backend_bounded(tmp_path):
+    backend = DiskBackend(str(tmp_path), maxsize=4)
+    for i in range(DiskBackend.PRUNE_EVERY):
+        backend.set(f'/?x={i}', ((i,), 200, [], b''))
+    assert len(list(tmp_path.iterdir())) == 4
+    # the most recently written entries are kept
+    assert backend.get(f'/?x={DiskBackend.PRUNE_EVERY - 1}') is not None
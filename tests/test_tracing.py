@@ -0,0 +1,68 @@
+import logging
+import sqlite3
+
+import pytest
+
+from flaskr import create_app
+from flaskr.db import close_pool, get_db
+from flaskr import tracing
+from flaskr.tracing import TracedConnection, get_sql_stats, normalize_sql
+
+
+@pytest.fixture
+def traced_app(app):
+    traced_app = create_app({
+        'TESTING': True, 'DATABASE': app.config['DATABASE'], 'SQL_TRACE': True,
+    })
+    yield traced_app
+    close_pool(traced_app)
+
+
+@pytest.fixture
+def client(traced_app):
+    return traced_app.test_client()
+
+
+def test_disabled_by_default(app):
+    response = app.test_client().get('/')
+    assert 'Server-Timing' not in response.headers
+    with app.app_context():
+        assert type(get_db()) is not TracedConnection
+
+
+def test_server_timing(traced_app, client):
+    with traced_app.app_context():
+        assert isinstance(get_db(), TracedConnection)
+
+    response = client.get('/1')
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('db;dur=')
+    assert 'queries"' in timing
+
+    stats = get_sql_stats(traced_app).stats()
+    assert stats['requests'] == 1
+    assert stats['statements'] > 0
+
+
+def test_slow_query_log(traced_app, client, caplog):
+    traced_app.config['SQL_SLOW_MS'] = 0
+    with caplog.at_level(logging.WARNING):
+        client.get('/1')
+    assert 'Slow query' in caplog.text
+    assert 'WHERE p.id = ?' in caplog.text
+    assert get_sql_stats(traced_app).stats()['slow'] > 0
+
+
+def test_outside_app_context(monkeypatch, caplog):
+    monkeypatch.setattr(tracing, 'SLOW_MS', 0)
+    db = sqlite3.connect(':memory:', factory=TracedConnection)
+    with caplog.at_level(logging.WARNING):
+        assert db.execute('SELECT 1').fetchone() == (1,)
+    assert 'Slow query' in caplog.text
+
+
+def test_normalize_sql():
+    assert normalize_sql(
+        "SELECT *  FROM post\n WHERE title = 'it''s' AND id IN (1, 2, 3) LIMIT 10"
+    ) == "SELECT * FROM post WHERE title = ? AND id IN (...) LIMIT ?"
+    assert normalize_sql('SELECT bm25(post_search) FROM t') == 'SELECT bm25(post_search) FROM t'